@@ -0,0 +1,519 @@
+"""
+``affordability.py``
+
+This module computes the weekly costs of living in the area units of a
+region of New Zealand relative to income, in the same way as the web
+maps do in ``rapyd/map.pyj``, but for all the area units of the region
+at once.
+It assumes that you have created the rents and commute costs files of
+the region already; see ``region.py``.
+
+The total weekly cost of living in an area unit comprises
+
+- the weekly rent of the chosen number of bedrooms to rent out of a
+  dwelling with the chosen number of bedrooms,
+- the weekly cost of the commutes to work,
+- the weekly parking cost at work, and
+- the weekly cost of owning the chosen number of cars.
+
+The total is undefined for an area unit if its rent is unknown or if
+one of the commutes from it is impossible.
+"""
+import json
+import os
+import argparse
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from region import REGIONS, MODES, Region, get_half_index, load_json,\
+  dump_json
+
+# Weekly cost of owning a car, as in ``rapyd/map.pyj``
+WEEKLY_CAR_OWN_COST = 2228/52
+MAX_BEDROOMS = 5
+# Range of annual incomes of the income slider of ``rapyd/map.pyj``
+MIN_INCOME = 100
+MAX_INCOME = 200000
+INCOME_STEP = 100
+# Fields of the scenarios of ``AffordabilityModel.evaluate_scenarios()``,
+# each a weekly total cost question with one commute
+SCENARIO_FIELDS = ['income', 'work_area_unit', 'mode', 'num_workdays', 
+  'parking_cost', 'num_bedrooms', 'num_bedrooms_rent', 'num_cars']
+# Number of scenarios evaluated at a time
+SCENARIO_CHUNK_SIZE = 4096
+
+# A weekly commute to work in the area unit with the given name
+# by the given mode (from ``MODES``) on the given number of workdays,
+# paying the given daily parking cost
+Commute = namedtuple('Commute', ['work_area_unit', 'mode', 'num_workdays',
+  'parking_cost'])
+Commute.__new__.__defaults__ = (5, 0)
+
+def get_rents_array(rents, index_by_name, max_bedrooms=MAX_BEDROOMS):
+    """
+    Given a decoded rents JSON dictionary (see ``Region.create_rents()``)
+    and a dictionary area unit name -> index, return an
+    n x (``max_bedrooms`` + 1) NumPy array whose entry (i, b) is the
+    median weekly rent of a dwelling with b bedrooms in area unit i,
+    with NaN for missing rents.
+    Column 0 is unused.
+    """
+    R = np.full((len(index_by_name), max_bedrooms + 1), np.nan)
+    for name, i in index_by_name.items():
+        rent_by_num_bedrooms = rents.get(name, {})
+        for b in range(1, max_bedrooms + 1):
+            rent = rent_by_num_bedrooms.get(str(b))
+            if rent is not None:
+                R[i, b] = rent
+    return R
+
+class AffordabilityModel(object):
+    """
+    Holds the rents and commute costs of a region as NumPy arrays
+    aligned to the area unit indices of the region's commute matrix,
+    so that each affordability question about all the area units
+    of the region is answered by a few array operations.
+    """
+    def __init__(self, index_by_name, rents, costs_by_mode, times_by_mode):
+        """
+        ``index_by_name`` is a dictionary area unit name -> index,
+        ``rents`` is the output of ``get_rents_array()`` for that index,
+        and ``costs_by_mode`` and ``times_by_mode`` are dictionaries
+        mode -> packed lower-triangular half-matrix of daily round-trip
+        commute costs and times, respectively, as float64 NumPy
+        arrays with NaN for impossible commutes;
+        see ``region.CommuteMatrix``.
+        """
+        self.index_by_name = index_by_name
+        self.names = sorted(index_by_name, key=index_by_name.get)
+        self.rents = rents
+        self.costs_by_mode = costs_by_mode
+        self.times_by_mode = times_by_mode
+        self._indices = np.arange(len(index_by_name))
+
+    def __len__(self):
+        return len(self.index_by_name)
+
+    @classmethod
+    def from_region(cls, region, key=None):
+        """
+        Build the model of the given ``region.Region`` from its rent
+        matrix file (see ``region.Region.get_rent_matrix()``), or its 
+        rents file if the former is missing or not aligned, 
+        and its commute costs file with the given key in 
+        ``region.path_by_data`` (defaulting to the one the web map uses;
+        see ``region.Region.get_web_commute_costs_key()``).
+        """
+        if key is None:
+            key = region.get_web_commute_costs_key()
+        matrix = region.get_commute_matrix(key)
+        rents = None
+        if os.path.isfile(region.path_by_data['rent_matrix']):
+            index_by_name, R = region.get_rent_matrix()
+            if index_by_name == matrix.index_by_name:
+                rents = np.where(R >= 0, R, np.nan)[:, :MAX_BEDROOMS + 1]
+        if rents is None:
+            rents = get_rents_array(load_json(region.path_by_data['rents']),
+              matrix.index_by_name)
+        costs_by_mode = {}
+        times_by_mode = {}
+        for mode in matrix.modes:
+            costs_by_mode[mode], times_by_mode[mode] =\
+              matrix.get_arrays(mode)
+        return cls(matrix.index_by_name, rents, costs_by_mode,
+          times_by_mode)
+
+    def get_commute_row(self, work_area_unit, mode):
+        """
+        Return the pair of NumPy arrays (costs, times) of length n of
+        the daily round-trip commute costs and times by the given mode
+        from each area unit to the area unit with the given name.
+        """
+        k = get_half_index(self._indices, self.index_by_name[work_area_unit])
+        return self.costs_by_mode[mode][k], self.times_by_mode[mode][k]
+
+    def get_weekly_rents(self, num_bedrooms=2, num_bedrooms_rent=1):
+        """
+        Return the NumPy array of weekly rents of ``num_bedrooms_rent``
+        of the ``num_bedrooms`` bedrooms of a dwelling in each area unit,
+        that is, the median rent of the dwelling scaled by
+        ``num_bedrooms_rent/num_bedrooms``.
+        """
+        return self.rents[:, num_bedrooms]*num_bedrooms_rent/num_bedrooms
+
+    def get_weekly_commute_costs_and_times(self, commutes):
+        """
+        Given a list of ``Commute`` objects, return the pair of NumPy
+        arrays (costs, times) of the total weekly commute cost and time
+        from each area unit.
+        Commutes with no workdays or no work area unit (``None``)
+        contribute nothing.
+        """
+        costs = np.zeros(len(self))
+        times = np.zeros(len(self))
+        for commute in commutes:
+            if not commute.num_workdays or commute.work_area_unit is None:
+                continue
+            c, t = self.get_commute_row(commute.work_area_unit, commute.mode)
+            costs += commute.num_workdays*c
+            times += commute.num_workdays*t
+        return costs, times
+
+    def get_weekly_total_costs(self, commutes, num_bedrooms=2,
+      num_bedrooms_rent=1, num_cars=0):
+        """
+        Return the NumPy array of total weekly costs of living in
+        each area unit given the commutes (a list of ``Commute``
+        objects), the number of bedrooms of the dwelling, the number of
+        those bedrooms to rent, and the number of cars owned.
+        Undefined totals are NaN.
+        """
+        rents = self.get_weekly_rents(num_bedrooms, num_bedrooms_rent)
+        commute_costs = self.get_weekly_commute_costs_and_times(commutes)[0]
+        parking_cost = sum(commute.parking_cost*commute.num_workdays
+          for commute in commutes)
+        return rents + commute_costs + num_cars*WEEKLY_CAR_OWN_COST +\
+          parking_cost
+
+    def get_weekly_total_cost_fractions(self, income, commutes,
+      num_bedrooms=2, num_bedrooms_rent=1, num_cars=0):
+        """
+        Return the NumPy array of the total weekly costs of living in
+        each area unit (see ``get_weekly_total_costs()``) divided by
+        the weekly income corresponding to the given annual income.
+        Undefined fractions are NaN.
+        """
+        return self.get_weekly_total_costs(commutes, num_bedrooms,
+          num_bedrooms_rent, num_cars)/(income/52)
+
+    def to_dict(self, values, digits=4):
+        """
+        Given a NumPy array of length n of values for the area units,
+        return a dictionary area unit name -> value rounded to
+        ``digits`` decimal places, with ``None`` for NaNs.
+        """
+        return {name: (round(v, digits) if v == v else None)
+          for name, v in zip(self.names, values.tolist())}
+
+    def evaluate_scenarios(self, scenarios, chunk_size=SCENARIO_CHUNK_SIZE,
+      num_workers=None):
+        """
+        Given a dictionary of scenarios with structure
+        field -> NumPy array of length m of the values of that field 
+        in each scenario,
+        for each field in ``SCENARIO_FIELDS``,
+        return the m x n float32 NumPy array whose entry (s, i) is the
+        weekly total cost fraction of living in area unit i in scenario
+        s, that is, the output of ``get_weekly_total_cost_fractions()``
+        with the income, the one ``Commute`` made of the work area unit
+        (with ``None`` or '' for none), mode, number of workdays, 
+        and parking cost, the number of bedrooms and bedrooms to rent,
+        and the number of cars of scenario s.
+        See ``get_scenario_grid()`` for making scenarios.
+
+        Evaluate ``chunk_size`` scenarios at a time, broadcasting over 
+        the scenarios of a chunk, in a pool of at most ``num_workers`` 
+        threads (defaulting to ``ThreadPoolExecutor``'s default), 
+        since NumPy releases the GIL in array operations.
+        """
+        m = len(scenarios['income'])
+        for field in SCENARIO_FIELDS:
+            assert len(scenarios[field]) == m,\
+              "Field {!s} must have {!s} values".format(field, m)
+
+        # Encode modes and work area units as indices, 
+        # with -1 for no work area unit
+        modes = sorted(self.costs_by_mode)
+        mode_values, mode_indices = np.unique(
+          np.asarray(scenarios['mode'], dtype=str), return_inverse=True)
+        assert set(mode_values) <= set(modes),\
+          "Modes must lie in {!s}".format(modes)
+        mode_indices = np.array([modes.index(mode) 
+          for mode in mode_values.tolist()], dtype=int)[mode_indices]
+        work_values, work_indices = np.unique(np.array(
+          [x or '' for x in scenarios['work_area_unit']], dtype=str), 
+          return_inverse=True)
+        work_indices = np.array([self.index_by_name[x] if x else -1 
+          for x in work_values.tolist()], dtype=int)[work_indices]
+        incomes = np.asarray(scenarios['income'], dtype=float)
+        num_workdays = np.asarray(scenarios['num_workdays'], dtype=float)
+        parking_costs = np.asarray(scenarios['parking_cost'], dtype=float)
+        num_bedrooms = np.asarray(scenarios['num_bedrooms'], dtype=int)
+        num_bedrooms_rent = np.asarray(scenarios['num_bedrooms_rent'], 
+          dtype=float)
+        num_cars = np.asarray(scenarios['num_cars'], dtype=float)
+
+        # Weekly commute costs by mode, work area unit, home area unit
+        n = len(self)
+        k = get_half_index(self._indices[:, None], self._indices[None, :])
+        commute_costs = np.stack([self.costs_by_mode[mode][k] 
+          for mode in modes])
+        # Rents by number of bedrooms, home area unit
+        rents = np.ascontiguousarray(self.rents.T)
+
+        result = np.empty((m, n), dtype=np.float32)
+        def evaluate_chunk(start):
+            s = slice(start, min(start + chunk_size, m))
+            d = num_workdays[s][:, None]
+            totals = rents[num_bedrooms[s]]*(num_bedrooms_rent[s]/
+              num_bedrooms[s])[:, None]
+            # A commute with no workdays or no work area unit 
+            # contributes nothing, even if impossible
+            commuting = (d > 0) & (work_indices[s] >= 0)[:, None]
+            totals += np.where(commuting, 
+              d*commute_costs[mode_indices[s], work_indices[s]], 0)
+            totals += num_cars[s][:, None]*WEEKLY_CAR_OWN_COST +\
+              parking_costs[s][:, None]*d
+            result[s] = totals/(incomes[s][:, None]/52)
+
+        with ThreadPoolExecutor(max_workers=num_workers) as executor:
+            list(executor.map(evaluate_chunk, range(0, m, chunk_size)))
+        return result
+
+def create_affordability_tables(region, key=None,
+  num_bedrooms_rent=1, num_workdays=5, block_size=64):
+    """
+    Precompute the weekly total cost of living in each (home) area unit
+    of the given ``region.Region`` for each work area unit, each mode in
+    ``MODES``, and each number of bedrooms 1, ..., ``MAX_BEDROOMS``, 
+    using the default settings of the web maps, namely one commute on
+    ``num_workdays`` workdays with no parking cost, renting 
+    ``num_bedrooms_rent`` bedrooms of the dwelling, and owning one car 
+    when commuting by car and none otherwise.
+    Costs are undefined (NaN) as in 
+    ``AffordabilityModel.get_weekly_total_costs()``.
+
+    Save the costs as a float32 array of shape 
+    (work area unit, mode, number of bedrooms - 1, home area unit), 
+    with area units in commute matrix index order, to the file 
+    ``region.path_by_data['affordability_tables']``.
+    Each work area unit's slice of the array is contiguous, 
+    so it can be read alone, e.g. by an HTTP range request.
+    Save an index to the JSON file 
+    ``region.path_by_data['affordability_tables_index']`` listing 
+    the home area unit names in order, the modes, the numbers of 
+    bedrooms, the settings above, the shape and byte length of a slice, 
+    and the byte offset of the slice of each work area unit.
+    See ``read_affordability_table()``.
+
+    Use the commute costs file with the given key, defaulting to the 
+    one the web map uses; see ``AffordabilityModel.from_region()``.
+    Compute ``block_size`` work area units at a time to bound memory use.
+    """
+    model = AffordabilityModel.from_region(region, key)
+    n = len(model)
+    num_bedrooms = list(range(1, MAX_BEDROOMS + 1))
+    # Weekly rent plus car cost by mode, number of bedrooms, home
+    fixed = np.array([[model.get_weekly_rents(b, num_bedrooms_rent) +
+      (WEEKLY_CAR_OWN_COST if mode == 'car' else 0) for b in num_bedrooms] 
+      for mode in MODES])
+    slice_shape = [len(MODES), len(num_bedrooms), n]
+    slice_bytes = 4*int(np.prod(slice_shape))
+
+    homes = np.arange(n)
+    with open(region.path_by_data['affordability_tables'], 'wb') as f:
+        for start in range(0, n, block_size):
+            works = np.arange(start, min(start + block_size, n))
+            k = get_half_index(works[:, None], homes[None, :])
+            # Weekly commute cost by work, mode, home
+            commute_costs = np.stack([num_workdays*model.costs_by_mode[mode][k]
+              for mode in MODES], axis=1)
+            block = commute_costs[:, :, None, :] + fixed[None, :, :, :]
+            f.write(block.astype('<f4').tobytes())
+
+    index = {
+      'names': model.names,
+      'modes': MODES,
+      'num_bedrooms': num_bedrooms,
+      'settings': {
+        'num_bedrooms_rent': num_bedrooms_rent,
+        'num_workdays': num_workdays,
+        'parking_cost': 0,
+        'num_cars': {mode: int(mode == 'car') for mode in MODES},
+        },
+      'dtype': '<f4',
+      'slice_shape': slice_shape,
+      'slice_bytes': slice_bytes,
+      'offset_by_name': {name: i*slice_bytes 
+        for (i, name) in enumerate(model.names)},
+    }
+    dump_json(index, region.path_by_data['affordability_tables_index'])
+
+def read_affordability_table(region, work_area_unit, index=None):
+    """
+    Read the slice of the affordability tables of the given 
+    ``region.Region`` (see ``create_affordability_tables()``) for 
+    the work area unit with the given name, without reading the rest of
+    the file, and return it as a float64 NumPy array of shape 
+    (mode, number of bedrooms - 1, home area unit).
+    Load the index of the tables if it is not given.
+    """
+    if index is None:
+        index = load_json(region.path_by_data['affordability_tables_index'])
+    with open(region.path_by_data['affordability_tables'], 'rb') as f:
+        f.seek(index['offset_by_name'][work_area_unit])
+        buffer = f.read(index['slice_bytes'])
+    return np.frombuffer(buffer, dtype=index['dtype']).reshape(
+      index['slice_shape']).astype(float)
+
+def get_scenario_grid(**values_by_field):
+    """
+    Return the scenarios (in the format of 
+    ``AffordabilityModel.evaluate_scenarios()``) of all combinations 
+    of the given values of each field in ``SCENARIO_FIELDS``, 
+    given as keyword arguments field=list of values, 
+    leaving out the combinations that rent more bedrooms than 
+    the dwelling has.
+    Combinations vary fastest in the last field of ``SCENARIO_FIELDS``.
+    The number of bedrooms to rent defaults to [1].
+
+    EXAMPLES::
+
+        >>> g = get_scenario_grid(income=range(100, 200001, 100),
+        ...   work_area_unit=['Willis Street-Cambridge Terrace'], 
+        ...   mode=MODES, num_workdays=[5], parking_cost=[0], 
+        ...   num_bedrooms=[1, 2, 3], num_cars=[0, 1])
+        >>> len(g['income'])
+        48000
+    """
+    values_by_field.setdefault('num_bedrooms_rent', [1])
+    assert set(values_by_field) == set(SCENARIO_FIELDS),\
+      "Fields must be {!s}".format(SCENARIO_FIELDS)
+    values = [np.array(list(values_by_field[field])) 
+      for field in SCENARIO_FIELDS]
+    indices = [a.ravel() for a in np.meshgrid(
+      *[np.arange(len(v)) for v in values], indexing='ij')]
+    result = {field: v[i] for field, v, i in 
+      zip(SCENARIO_FIELDS, values, indices)}
+    valid = result['num_bedrooms_rent'] <= result['num_bedrooms']
+    return {field: v[valid] for field, v in result.items()}
+
+def create_scenario_sweep(region, scenarios, path=None, 
+  key=None, chunk_size=SCENARIO_CHUNK_SIZE, num_workers=None):
+    """
+    Evaluate the given scenarios on the given ``region.Region``
+    (see ``AffordabilityModel.evaluate_scenarios()``) and save the
+    results to the given path (defaulting to 
+    ``region.path_by_data['scenario_sweep']``) as an uncompressed 
+    NumPy .npz file with one array per column: 
+    one for each field in ``SCENARIO_FIELDS``, 'names' (the area unit 
+    names in index order), and 'fractions' (the m x n float32 
+    array of weekly total cost fractions, NaN where undefined).
+    Work area units of ``None`` are saved as ''.
+    Use the commute costs file with the given key, defaulting to the 
+    one the web map uses.
+    Return the path.
+    """
+    if path is None:
+        path = region.path_by_data['scenario_sweep']
+    model = AffordabilityModel.from_region(region, key)
+    fractions = model.evaluate_scenarios(scenarios, chunk_size, num_workers)
+    columns = {field: np.asarray(scenarios[field]) 
+      for field in SCENARIO_FIELDS}
+    columns['work_area_unit'] = np.array([x or '' 
+      for x in scenarios['work_area_unit']], dtype=str)
+    np.savez(path, names=np.array(model.names, dtype=str), 
+      fractions=fractions, **columns)
+    return path
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compute the '
+      'affordability of the area units of regions of New Zealand.')
+    subparsers = parser.add_subparsers(dest='command')
+
+    p = subparsers.add_parser('evaluate', help='print the weekly total '
+      'cost of living in each area unit of a region as a fraction of '
+      'income, as JSON')
+    p.add_argument('region', choices=sorted(REGIONS))
+    p.add_argument('work_area_unit', help='name of the area unit of work')
+    p.add_argument('income', type=float, help='annual income')
+    p.add_argument('-m', '--mode', choices=MODES, default='bicycle')
+    p.add_argument('-d', '--workdays', type=int, default=5)
+    p.add_argument('-p', '--parking', type=float, default=0,
+      help='daily parking cost')
+    p.add_argument('-b', '--bedrooms', type=int, default=2)
+    p.add_argument('-r', '--bedrooms-rent', type=int, default=1)
+    p.add_argument('-c', '--cars', type=int, default=0)
+    p.add_argument('-k', '--key', default=None,
+      choices=['commute_costs', 'fake_commute_costs'],
+      help='commute costs file to use; defaults to the one the web map '
+      'uses')
+
+    p = subparsers.add_parser('tables', help='create the affordability '
+      'tables of regions; see create_affordability_tables()')
+    p.add_argument('regions', nargs='*', metavar='region',
+      help='regions, from {!s}; defaults to all'.format(sorted(REGIONS)))
+    p.add_argument('-k', '--key', default=None,
+      choices=['commute_costs', 'fake_commute_costs'],
+      help='commute costs file to use; defaults to the one the web map '
+      'uses')
+
+    p = subparsers.add_parser('sweep', help='evaluate the weekly total cost '
+      'fractions of a region for all combinations of the given settings '
+      'and save them; see create_scenario_sweep()')
+    p.add_argument('region', choices=sorted(REGIONS))
+    p.add_argument('work_area_units', nargs='+', metavar='work_area_unit',
+      help='names of the area units of work')
+    p.add_argument('-i', '--incomes', type=float, nargs=3, 
+      metavar=('START', 'STOP', 'STEP'), 
+      default=[MIN_INCOME, MAX_INCOME, INCOME_STEP],
+      help='range of annual incomes, including STOP')
+    p.add_argument('-m', '--modes', nargs='+', choices=MODES, default=MODES)
+    p.add_argument('-d', '--workdays', type=int, nargs='+', default=[5])
+    p.add_argument('-p', '--parking', type=float, nargs='+', default=[0],
+      help='daily parking costs')
+    p.add_argument('-b', '--bedrooms', type=int, nargs='+', 
+      default=list(range(1, MAX_BEDROOMS + 1)))
+    p.add_argument('-r', '--bedrooms-rent', type=int, nargs='+', 
+      default=[1])
+    p.add_argument('-c', '--cars', type=int, nargs='+', default=[0])
+    p.add_argument('-k', '--key', default=None,
+      choices=['commute_costs', 'fake_commute_costs'],
+      help='commute costs file to use; defaults to the one the web map '
+      'uses')
+    p.add_argument('-o', '--output', default=None, 
+      help='path of the output .npz file; defaults to scenario_sweep.npz '
+      'in the region directory')
+    p.add_argument('-w', '--workers', type=int, default=None,
+      help='number of worker threads')
+    args = parser.parse_args()
+
+    if args.command == 'evaluate':
+        region = Region('data/' + args.region + '/')
+        key = args.key or region.get_web_commute_costs_key()
+        if not os.path.isfile(region.path_by_data[key]) and\
+          not os.path.isfile(region.path_by_data[key + '_binary']):
+            parser.error('{!s} has no {!s} file'.format(args.region, key))
+        model = AffordabilityModel.from_region(region, key)
+        commute = Commute(args.work_area_unit, args.mode, args.workdays,
+          args.parking)
+        fractions = model.get_weekly_total_cost_fractions(args.income,
+          [commute], args.bedrooms, args.bedrooms_rent, args.cars)
+        print(json.dumps(model.to_dict(fractions), sort_keys=True))
+    elif args.command == 'tables':
+        for name in args.regions or sorted(REGIONS):
+            region = Region('data/' + name + '/')
+            key = args.key or region.get_web_commute_costs_key()
+            if not os.path.isfile(region.path_by_data[key]) and\
+              not os.path.isfile(region.path_by_data[key + '_binary']):
+                print('Skipping {!s}, which has no {!s} file'.format(name, 
+                  key))
+                continue
+            print('Creating affordability tables for {!s}...'.format(name))
+            create_affordability_tables(region, key)
+    elif args.command == 'sweep':
+        start, stop, step = args.incomes
+        scenarios = get_scenario_grid(
+          income=np.arange(start, stop + step/2, step), 
+          work_area_unit=args.work_area_units, mode=args.modes, 
+          num_workdays=args.workdays, parking_cost=args.parking,
+          num_bedrooms=args.bedrooms, num_bedrooms_rent=args.bedrooms_rent,
+          num_cars=args.cars)
+        path = create_scenario_sweep(Region('data/' + args.region + '/'),
+          scenarios, args.output, args.key, num_workers=args.workers)
+        print('Saved {!s} scenarios to {!s}'.format(
+          len(scenarios['income']), path))
+    else:
+        parser.print_help()
@@ -0,0 +1,454 @@
+"""
+``benchmark.py``
+
+This module times the stages of the pipeline that builds the data files
+of regions of New Zealand (see ``region.py``) and measures their peak
+memory use, so that the effect of a change to the pipeline can be
+measured and compared across commits.
+
+It benchmarks each existing region in ``data/`` and synthetic regions
+of chosen numbers of area units, working on copies of the regions in a
+temporary workspace so that ``data/`` is left untouched.
+If the master shapes file ``MASTER_SHAPES_FILE`` does not exist,
+then the workspace's one is assembled from the shapes files of the
+existing regions.
+
+Run ``python benchmark.py run`` to write the results to a JSON file
+and ``python benchmark.py compare OLD NEW`` to compare two such files;
+see ``python benchmark.py --help`` for options.
+"""
+import json
+import csv
+import os
+import time
+import shutil
+import tempfile
+import platform
+import argparse
+import functools
+import datetime
+import subprocess
+import tracemalloc
+
+import numpy as np
+
+from region import MASTER_SHAPES_FILE, MASTER_RENTS_FILE, NAME_FIELD,\
+  REGIONS, MODES, STAGES, Region, RentTable, FileCache, load_json,\
+  dump_json, make_feature_collection, get_master_index,\
+  index_master_shapes, get_bird_distance_and_time
+
+SIZES = [1000, 2000, 5000]
+# Synthetic regions larger than this get no commute CSV files,
+# since these grow quadratically
+MAX_COMMUTES_SIZE = 2000
+# Side in degrees of the square area units of synthetic regions
+SYNTHETIC_CELL_SIZE = 0.01
+# Southwest corner of synthetic regions
+SYNTHETIC_ORIGIN = (172.0, -43.5)
+# Speed in kilometers per hour and detour factor over the bird distance
+# of the synthetic commutes of each mode
+SYNTHETIC_SPEED_BY_MODE = {'walk': 5, 'bicycle': 15, 'car': 40,
+  'transit': 25}
+SYNTHETIC_DETOUR = 1.3
+
+def get_commit():
+    """
+    Return the hash of the git commit checked out in the directory of
+    this module, or ``None`` if that cannot be determined.
+    """
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'],
+          cwd=os.path.dirname(os.path.abspath(__file__)),
+          stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def get_benchmark_stages(region):
+    """
+    Return the list of build stages (from ``STAGES``, in order) to
+    benchmark for the given region, namely those that apply to it
+    (see ``Region.get_stages()``) along with 'fake_commute_costs'.
+    """
+    stages = set(region.get_stages()) | {'fake_commute_costs'}
+    return [stage for stage in STAGES if stage in stages]
+
+def save_files(paths, directory):
+    """
+    Copy the files at the given paths into the given directory
+    and return a dictionary with structure
+    path -> path of the copy, or ``None`` if the file does not exist,
+    to pass to ``restore_files()``.
+    """
+    copy_by_path = {}
+    for i, path in enumerate(paths):
+        if os.path.isfile(path):
+            copy = os.path.join(directory, '{:d}_{!s}'.format(i,
+              os.path.basename(path)))
+            shutil.copy2(path, copy)
+            copy_by_path[path] = copy
+        else:
+            copy_by_path[path] = None
+    return copy_by_path
+
+def restore_files(copy_by_path):
+    """
+    Restore the files saved by ``save_files()``, deleting those that
+    did not exist then.
+    """
+    for path, copy in copy_by_path.items():
+        if copy is not None:
+            shutil.copy2(copy, path)
+        elif os.path.isfile(path):
+            os.remove(path)
+
+def measure(function, memory=True, reset=None):
+    """
+    Call the given function with no arguments and return the pair
+    (wall time in seconds, peak memory in bytes allocated during
+    the call), where the latter is ``None`` if not ``memory``.
+
+    Peak memory is measured with ``tracemalloc``, which sees the
+    allocations of Python objects and NumPy arrays but not those
+    of extension libraries such as GEOS and PROJ.
+    Because tracing slows the call down, time it untraced and then
+    call it again traced to measure its memory.
+    If given, call ``reset`` with no arguments before the traced call,
+    so that it starts from the same state as the timed one, e.g. to
+    undo a function that modifies files in place.
+    """
+    start = time.perf_counter()
+    function()
+    seconds = time.perf_counter() - start
+    peak = None
+    if memory:
+        if reset is not None:
+            reset()
+        tracemalloc.start()
+        try:
+            function()
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    return seconds, peak
+
+def create_synthetic_region(name, num_area_units, commutes=True, seed=0):
+    """
+    Create in ``data/<name>/`` a synthetic region of ``num_area_units``
+    square area units laid out in a grid, with an area units file,
+    monthly pass fare zones and fares files (three zones in vertical
+    bands), and, if ``commutes``, commute CSV files for every mode
+    derived from the bird distances between the area units' centres.
+
+    Return the pair (features, rent rows), where ``features`` is the
+    list of decoded GeoJSON features of the area units to add to
+    the master shapes file and ``rent rows`` is the list of rows to add
+    to the master rents file.
+    """
+    rng = np.random.RandomState(seed)
+    path = os.path.join('data', name)
+    os.makedirs(path, exist_ok=True)
+    k = int(np.ceil(np.sqrt(num_area_units)))
+    x0, y0 = SYNTHETIC_ORIGIN
+    s = SYNTHETIC_CELL_SIZE
+    # Points per side of each square, so that the shapes have a
+    # realistic number of vertices
+    t = np.linspace(0, s, 9)[:-1]
+
+    names = []
+    centres = []
+    features = []
+    rent_rows = []
+    for i in range(num_area_units):
+        area_unit = '{!s} {:05d}'.format(name.title(), i)
+        x, y = x0 + (i % k)*s, y0 + (i//k)*s
+        ring = [[x + u, y] for u in t] + [[x + s, y + u] for u in t] +\
+          [[x + s - u, y + s] for u in t] + [[x, y + s - u] for u in t] +\
+          [[x, y]]
+        names.append(area_unit)
+        centres.append([x + s/2, y + s/2])
+        features.append({
+          'type': 'Feature',
+          'properties': {NAME_FIELD: area_unit},
+          'geometry': {'type': 'Polygon', 'coordinates': [ring]},
+          })
+        for b in range(1, 6):
+            if rng.rand() < 0.2:
+                rent = ''
+            else:
+                rent = str(100 + 60*b + rng.randint(0, 100))
+            rent_rows.append([area_unit, str(b),
+              str(rng.randint(5, 100)), rent, rent])
+
+    with open(os.path.join(path, 'area_units.csv'), 'w') as f:
+        writer = csv.writer(f)
+        writer.writerow(['2013 area unit name', '2013 area unit code'])
+        for i, area_unit in enumerate(names):
+            writer.writerow([area_unit, str(900000 + i)])
+
+    # Fare zones
+    zones = ['A', 'B', 'C']
+    width = k*s/len(zones)
+    zone_features = []
+    for j, zone in enumerate(zones):
+        a, b = x0 + j*width, x0 + (j + 1)*width
+        zone_features.append({
+          'type': 'Feature',
+          'properties': {'fare_zone': zone},
+          'geometry': {'type': 'Polygon', 'coordinates': [[[a, y0],
+            [b, y0], [b, y0 + k*s], [a, y0 + k*s], [a, y0]]]},
+          })
+    dump_json(make_feature_collection(zone_features),
+      os.path.join(path, 'monthly_pass_fare_zones.geojson'))
+    with open(os.path.join(path, 'monthly_pass_fares.csv'), 'w') as f:
+        writer = csv.writer(f)
+        writer.writerow(['origin zone', ' destination zone',
+          ' monthly fare in NZD for unlimited travel'])
+        for j, a in enumerate(zones):
+            for l, b in enumerate(zones):
+                writer.writerow([a, b, str(140 + 50*abs(j - l))])
+
+    if commutes:
+        centres = np.array(centres)
+        for mode in MODES:
+            with open(os.path.join(path, mode + '_commutes.csv'), 'w') as f:
+                writer = csv.writer(f)
+                writer.writerow(['origin area unit', 'destination area unit',
+                  'distance (kilometers)', 'time (hours)'])
+                speed = SYNTHETIC_SPEED_BY_MODE[mode]
+                for i, origin in enumerate(names):
+                    d = SYNTHETIC_DETOUR*get_bird_distance_and_time(
+                      centres[i], centres)[0]
+                    writer.writerows([origin, destination,
+                      '{:.3f}'.format(x), '{:.3f}'.format(x/speed)]
+                      for destination, x in zip(names, d))
+
+    return features, rent_rows
+
+def create_workspace(path, region_names, sizes,
+  max_commutes_size=MAX_COMMUTES_SIZE, data_dir='data'):
+    """
+    Set up a benchmark workspace in the directory at the given path
+    (which will contain a ``data/`` directory laid out as ``data_dir``),
+    comprising copies of the existing regions with the given names,
+    synthetic regions 'synthetic_<n>' (see ``create_synthetic_region()``)
+    for each number of area units ``n`` in ``sizes``, and master shapes
+    and rents files covering them all.
+    The synthetic regions get commute CSV files only if they have at
+    most ``max_commutes_size`` area units.
+
+    Return the list of the names of the regions in the workspace.
+    """
+    cwd = os.getcwd()
+    data_dir = os.path.abspath(data_dir)
+    os.makedirs(os.path.join(path, 'data'))
+    for name in region_names:
+        shutil.copytree(os.path.join(data_dir, name),
+          os.path.join(path, 'data', name))
+
+    os.chdir(path)
+    try:
+        # Master shapes file
+        master_shapes = os.path.join(data_dir,
+          os.path.basename(MASTER_SHAPES_FILE))
+        if os.path.isfile(master_shapes):
+            features = load_json(master_shapes)['features']
+        else:
+            features = []
+            for name in sorted(REGIONS):
+                region_shapes = os.path.join(data_dir, name,
+                  'shapes.geojson')
+                if os.path.isfile(region_shapes):
+                    features.extend(load_json(region_shapes)['features'])
+
+        # Master rents file
+        with open(os.path.join(data_dir,
+          os.path.basename(MASTER_RENTS_FILE))) as f:
+            rent_rows = list(csv.reader(f))
+
+        names = list(region_names)
+        for n in sizes:
+            name = 'synthetic_{:d}'.format(n)
+            new_features, new_rent_rows = create_synthetic_region(name, n,
+              commutes=n <= max_commutes_size)
+            features.extend(new_features)
+            rent_rows.extend(new_rent_rows)
+            names.append(name)
+
+        dump_json(make_feature_collection(features), MASTER_SHAPES_FILE,
+          compact=True)
+        with open(MASTER_RENTS_FILE, 'w') as f:
+            csv.writer(f).writerows(rent_rows)
+    finally:
+        os.chdir(cwd)
+    return names
+
+def benchmark_region(name, memory=True):
+    """
+    Benchmark the stages of the region with the given name in the
+    current directory (see ``get_benchmark_stages()`` and
+    ``measure()``), in order, and return the list of results,
+    each a dictionary with the keys 'region', 'num_area_units', 'stage',
+    'seconds', and 'peak_memory' (bytes or ``None``).
+
+    Read the region's files without a file cache, so that every stage
+    pays for its reads, and restore the stage's input and output files
+    before measuring its memory, so that both calls do the same work.
+    """
+    region = Region(os.path.join('data', name) + '/', cache=FileCache(0))
+    num_area_units = len(region.get_area_units())
+    results = []
+    for stage in get_benchmark_stages(region):
+        inputs, outputs = region.get_stage_files(stage)
+        with tempfile.TemporaryDirectory(prefix='stage_') as directory:
+            copy_by_path = save_files(sorted(set(inputs) | set(outputs)),
+              directory)
+            seconds, peak = measure(region.get_stage_function(stage),
+              memory, functools.partial(restore_files, copy_by_path))
+        results.append({
+          'region': name,
+          'num_area_units': num_area_units,
+          'stage': stage,
+          'seconds': seconds,
+          'peak_memory': peak,
+          })
+        print('  {:<20s}{:8.2f} s{:>14s}'.format(stage, seconds,
+          '' if peak is None else '{:,.1f} MB'.format(peak/2**20)))
+    return results
+
+def run(region_names=None, sizes=SIZES, out_path='benchmark.json',
+  memory=True, max_commutes_size=MAX_COMMUTES_SIZE, keep_workspace=False):
+    """
+    Benchmark the existing regions with the given names (all of
+    ``REGIONS`` if ``region_names is None``) and synthetic regions
+    with the given numbers of area units in a temporary workspace
+    (see ``create_workspace()`` and ``benchmark_region()``),
+    print the results as they come, and save them to a JSON file at
+    ``out_path``, along with the commit and environment benchmarked.
+    Include the time and memory taken to index the master files
+    as the results of the stage 'index_master_files' of the region
+    'master'.
+    Delete the workspace afterwards unless ``keep_workspace``.
+
+    Return the decoded JSON results.
+    """
+    if region_names is None:
+        region_names = sorted(REGIONS)
+    assert set(region_names) <= REGIONS,\
+      "Regions must lie in {!s}".format(sorted(REGIONS))
+    out_path = os.path.abspath(out_path)
+
+    workspace = tempfile.mkdtemp(prefix='benchmark_')
+    cwd = os.getcwd()
+    results = []
+    try:
+        print('Creating workspace {!s}...'.format(workspace))
+        names = create_workspace(workspace, region_names, sizes,
+          max_commutes_size)
+        os.chdir(workspace)
+
+        def index_master_files():
+            for path in [MASTER_SHAPES_FILE, MASTER_RENTS_FILE]:
+                for extension in ['.idx', '.features', '.npz']:
+                    if os.path.isfile(path + extension):
+                        os.remove(path + extension)
+            get_master_index(MASTER_SHAPES_FILE, index_master_shapes)
+            RentTable.load(MASTER_RENTS_FILE)
+
+        print('master')
+        seconds, peak = measure(index_master_files, memory)
+        results.append({'region': 'master', 'num_area_units': None,
+          'stage': 'index_master_files', 'seconds': seconds,
+          'peak_memory': peak})
+        print('  {:<20s}{:8.2f} s'.format('index_master_files', seconds))
+
+        for name in names:
+            print(name)
+            results.extend(benchmark_region(name, memory))
+    finally:
+        os.chdir(cwd)
+        if keep_workspace:
+            print('Kept workspace {!s}'.format(workspace))
+        else:
+            shutil.rmtree(workspace)
+
+    output = {
+      'created': datetime.datetime.now().isoformat(timespec='seconds'),
+      'commit': get_commit(),
+      'python': platform.python_version(),
+      'numpy': np.__version__,
+      'platform': platform.platform(),
+      'results': results,
+      }
+    with open(out_path, 'w') as f:
+        json.dump(output, f, indent=2)
+    print('Saved results to {!s}'.format(out_path))
+    return output
+
+def compare(old_path, new_path):
+    """
+    Print the ratios of the times and peak memories of the stages
+    benchmarked in both of the given JSON results files
+    (see ``run()``), new over old.
+
+    Return a dictionary with structure
+    (region, stage) -> {'seconds': ratio, 'peak_memory': ratio or None}.
+    """
+    def get_result_by_key(path):
+        return {(r['region'], r['stage']): r
+          for r in load_json(path)['results']}
+
+    old = get_result_by_key(old_path)
+    new = get_result_by_key(new_path)
+    ratio_by_key = {}
+    print('{:<16s}{:<20s}{:>10s}{:>10s}{:>8s}{:>8s}'.format('region',
+      'stage', 'old s', 'new s', 'time', 'memory'))
+    for key in sorted(set(old) & set(new)):
+        a, b = old[key], new[key]
+        time_ratio = b['seconds']/a['seconds'] if a['seconds'] else None
+        memory_ratio = None
+        if a['peak_memory'] and b['peak_memory'] is not None:
+            memory_ratio = b['peak_memory']/a['peak_memory']
+        ratio_by_key[key] = {'seconds': time_ratio,
+          'peak_memory': memory_ratio}
+        print('{:<16s}{:<20s}{:>10.2f}{:>10.2f}{:>8s}{:>8s}'.format(
+          key[0], key[1], a['seconds'], b['seconds'],
+          '-' if time_ratio is None else '{:.2f}'.format(time_ratio),
+          '-' if memory_ratio is None else '{:.2f}'.format(memory_ratio)))
+    return ratio_by_key
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the pipeline '
+      'that builds the data files of regions of New Zealand.')
+    subparsers = parser.add_subparsers(dest='command')
+
+    p = subparsers.add_parser('run', help='benchmark the build stages of '
+      'existing and synthetic regions; see run()')
+    p.add_argument('-r', '--regions', nargs='*', metavar='region',
+      help='existing regions, from {!s}; defaults to all'.format(
+      sorted(REGIONS)))
+    p.add_argument('-n', '--sizes', nargs='*', type=int, default=SIZES,
+      metavar='size', help='numbers of area units of the synthetic '
+      'regions; defaults to {!s}'.format(SIZES))
+    p.add_argument('-o', '--out', default='benchmark.json',
+      help='JSON results file')
+    p.add_argument('--max-commutes-size', type=int,
+      default=MAX_COMMUTES_SIZE, help='largest synthetic region to '
+      'give commute CSV files')
+    p.add_argument('--no-memory', action='store_true',
+      help='skip measuring peak memory')
+    p.add_argument('--keep', action='store_true',
+      help='keep the workspace')
+
+    p = subparsers.add_parser('compare', help='compare two JSON results '
+      'files')
+    p.add_argument('old')
+    p.add_argument('new')
+    args = parser.parse_args()
+
+    if args.command == 'run':
+        run(args.regions, args.sizes, args.out, not args.no_memory,
+          args.max_commutes_size, args.keep)
+    elif args.command == 'compare':
+        compare(args.old, args.new)
+    else:
+        parser.print_help()
@@ -0,0 +1,54 @@
+"""
+Fixtures shared by the tests, run with ``python -m pytest``.
+"""
+import csv
+import os
+
+import pytest
+
+from region import MASTER_RENTS_FILE, Region, dump_json,\
+  make_feature_collection
+from benchmark import create_synthetic_region
+
+NUM_AREA_UNITS = 30
+
+def make_region(name='synthetic', num_area_units=NUM_AREA_UNITS):
+    """
+    Create in the current directory a synthetic region with the given
+    name and number of area units (see
+    ``benchmark.create_synthetic_region()``) along with its shapes,
+    centroids with fare zones, and rents, and with some missing
+    commutes, and return it.
+    """
+    features, rent_rows = create_synthetic_region(name, num_area_units)
+    with open(MASTER_RENTS_FILE, 'w') as f:
+        writer = csv.writer(f)
+        writer.writerow(['area unit name', 'number of bedrooms', 'count',
+          'median weekly rent', 'mean weekly rent'])
+        writer.writerows(rent_rows)
+    region = Region(os.path.join('data', name) + '/')
+    dump_json(make_feature_collection(features),
+      region.path_by_data['shapes'])
+    region.create_centroids()
+    region.add_fare_zones()
+    region.create_rents()
+    # Knock out some commutes
+    for mode in ['walk', 'transit']:
+        path = region.path_by_data[mode + '_commutes']
+        with open(path) as f:
+            rows = list(csv.reader(f))
+        for row in rows[7::11]:
+            row[2] = row[3] = ''
+        with open(path, 'w') as f:
+            csv.writer(f).writerows(rows)
+    return region
+
+@pytest.fixture
+def region(tmp_path, monkeypatch):
+    """
+    A synthetic region of ``NUM_AREA_UNITS`` area units (see 
+    ``make_region()``) in a temporary working directory.
+    """
+    monkeypatch.chdir(tmp_path)
+    os.makedirs('data')
+    return make_region()
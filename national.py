@@ -0,0 +1,371 @@
+"""
+``national.py``
+
+This module builds and reads a national commute matrix, that is,
+the daily round-trip commute costs and times between all pairs of
+area units in ``MASTER_SHAPES_FILE``, including pairs in different
+regions, such as Waikato to Auckland.
+
+The matrix is too big to handle like the per-region commute matrices
+(see ``region.CommuteMatrix``), so it is built block by block and
+stored in a tiled binary file, from which a single origin row or the
+submatrix of a region can be read without loading the rest;
+see ``TiledCommuteMatrix``.
+Run ``python national.py build`` to build it; see
+``python national.py --help`` for options.
+"""
+import json
+import struct
+import os
+import argparse
+
+import numpy as np
+
+from region import MASTER_SHAPES_FILE, NAME_FIELD, REGIONS, MODES,\
+  COMMUTE_COST_PER_KM_BY_MODE, BIRD_TIME_FACTOR_BY_MODE, Region,\
+  CommuteMatrix, assert_file_exists,\
+  get_master_index, index_master_shapes, get_master_features,\
+  make_feature_collection, get_centroids, get_bird_distance_and_time,\
+  get_half_matrix_costs, round_array
+
+NATIONAL_COMMUTE_COSTS_FILE = 'data/national_commute_costs.bin'
+BLOCK_SIZE = 256
+
+def get_bird_commute_costs(a, b):
+    """
+    Given m x 2 and k x 2 NumPy arrays of WGS84 longitude-latitude
+    points ``a`` and ``b``, return a dictionary with structure
+    mode -> pair (costs, times) of m x k arrays of round-trip commute
+    costs in dollars and times in hours between the points,
+    with NaN for missing commutes.
+    Derive them from the distances and times as the bird flies,
+    exactly as ``Region.create_fake_commute_costs()`` does,
+    so times are rounded to 1 decimal place.
+    """
+    distances, times = get_bird_distance_and_time(a[:, None, :],
+      b[None, :, :])
+    distances = round_array(distances, 2)
+    times = round_array(times, 2)
+    result = {}
+    for mode in MODES:
+        t = times*BIRD_TIME_FACTOR_BY_MODE[mode]
+        result[mode] = get_half_matrix_costs(distances + distances, t + t,
+          COMMUTE_COST_PER_KM_BY_MODE[mode], time_digits=1)
+    return result
+
+def get_morton_codes(points, bits=16):
+    """
+    Given an n x 2 NumPy array of points, return the array of their
+    Morton codes, that is, their positions along a Z-order curve
+    through their bounding box, so that sorting points by code
+    keeps nearby points mostly together.
+    """
+    points = np.asarray(points, dtype=float)
+    low = points.min(axis=0)
+    span = points.max(axis=0) - low
+    span[span == 0] = 1
+    q = ((points - low)/span*(2**bits - 1)).astype(np.uint64)
+    codes = np.zeros(len(points), dtype=np.uint64)
+    for b in range(bits):
+        for axis in range(2):
+            codes |= ((q[:, axis] >> np.uint64(b)) & np.uint64(1)) <<\
+              np.uint64(2*b + axis)
+    return codes
+
+def get_national_centroids(path=MASTER_SHAPES_FILE, chunk_size=BLOCK_SIZE):
+    """
+    Return a dictionary with structure
+    area unit name -> WGS84 longitude-latitude centroid
+    for all the area units in the master shapes file at the given path.
+    Read the features through the file's index (see
+    ``get_master_features()``) ``chunk_size`` area units at a time,
+    so that only one chunk of shapes is in memory at once.
+    If an area unit has several features, then use the last,
+    as ``Region.get_centroids_dict()`` does.
+    """
+    names = sorted(get_master_index(path, index_master_shapes))
+    centroid_by_name = {}
+    for start in range(0, len(names), chunk_size):
+        features = get_master_features(names[start:start + chunk_size], path)
+        for f in get_centroids(make_feature_collection(features))['features']:
+            centroid_by_name[f['properties'][NAME_FIELD]] =\
+              f['geometry']['coordinates']
+    return centroid_by_name
+
+def get_national_order(centroid_by_name):
+    """
+    Given a dictionary area unit name -> centroid, return the list of
+    area unit names in the order of the rows of the national commute
+    matrix, namely grouped by region (in the order of ``REGIONS``,
+    followed by the area units in no region), and ordered within each
+    group by the Morton codes of their centroids
+    (see ``get_morton_codes()``).
+    Keeping regions and neighborhoods together keeps the tiles read for
+    a region or a neighborhood few.
+    """
+    names = sorted(centroid_by_name)
+    group_by_name = {}
+    for k, region_name in enumerate(sorted(REGIONS)):
+        path = os.path.join('data', region_name, 'area_units.csv')
+        if os.path.isfile(path):
+            for name in Region(os.path.dirname(path) + '/').get_area_units():
+                group_by_name.setdefault(name, k)
+    groups = np.array([group_by_name.get(name, len(REGIONS))
+      for name in names])
+    codes = get_morton_codes([centroid_by_name[name] for name in names])
+    return [names[k] for k in np.lexsort((codes, groups))]
+
+class TiledCommuteMatrix(object):
+    """
+    Represents the daily round-trip commute costs and times between
+    a large number n of area units, stored in a tiled binary file,
+    such as the national commute matrix;
+    see ``create_national_commute_costs()``.
+
+    Round-trip commutes are symmetric, so the n x n matrix of each
+    mode is cut into square blocks of side ``block_size``
+    (the last block row and column padded with NaN), and only the
+    tiles (I, J) on or below the block diagonal are stored,
+    in the order (0, 0), (1, 0), (1, 1), (2, 0), ..., that is,
+    tile (I, J) comes ``I*(I + 1)//2 + J``-th.
+    Each tile holds, for each mode in order,
+    the float32 block of costs followed by the float32 block of times.
+
+    The file comprises the 4-byte magic string ``BINARY_MAGIC``,
+    the format version and the byte length L of a header as
+    little-endian unsigned 32-bit integers, the UTF-8 encoded JSON header
+    of length L listing the area unit names in index order, the modes,
+    the block size, and the number of digits that costs and times are
+    rounded to, and finally the tiles.
+    Loading a file memory-maps the tiles, so that reading a row or a
+    region only reads the tiles it needs.
+    """
+    BINARY_MAGIC = b'NZCT'
+    BINARY_VERSION = 1
+
+    def __init__(self, path):
+        assert_file_exists(path)
+        with open(path, 'rb') as f:
+            magic, version, header_length = struct.unpack('<4sII',
+              f.read(12))
+            assert magic == self.BINARY_MAGIC and\
+              version == self.BINARY_VERSION,\
+              "The file {!s} is not a tiled commute matrix".format(path)
+            header = json.loads(f.read(header_length).decode('utf-8'))
+        self.path = path
+        self.names = header['names']
+        self.index_by_name = {name: i for (i, name) in enumerate(self.names)}
+        self.modes = header['modes']
+        self.block_size = header['block_size']
+        self.cost_digits = header['cost_digits']
+        self.time_digits = header['time_digits']
+        B = self.block_size
+        m = -(-len(self.names) // B)
+        self.tiles = np.memmap(path, dtype='<f4', mode='r',
+          offset=12 + header_length,
+          shape=(m*(m + 1)//2, len(self.modes), 2, B, B))
+
+    def __len__(self):
+        return len(self.names)
+
+    @classmethod
+    def write(cls, path, names, get_block, modes=MODES,
+      block_size=BLOCK_SIZE, cost_digits=2, time_digits=1):
+        """
+        Write a tiled commute matrix file to the given path for the
+        area units with the given names (in index order) and modes,
+        getting the contents of each tile (I, J) from
+        ``get_block(I_indices, J_indices)``, which must return a
+        dictionary mode -> (costs, times) of arrays of shape
+        ``(len(I_indices), len(J_indices))``.
+        Write each tile as it comes, so that memory use is bounded by
+        the size of a tile.
+        """
+        header = json.dumps({
+          'names': list(names),
+          'modes': list(modes),
+          'block_size': block_size,
+          'cost_digits': cost_digits,
+          'time_digits': time_digits,
+          }).encode('utf-8')
+        # Pad header so that the tiles are 4-byte aligned
+        header += b' '*(-len(header) % 4)
+        n = len(names)
+        B = block_size
+        m = -(-n // B)
+        tmp_path = '{!s}.{!s}.tmp'.format(path, os.getpid())
+        with open(tmp_path, 'wb') as f:
+            f.write(struct.pack('<4sII', cls.BINARY_MAGIC,
+              cls.BINARY_VERSION, len(header)))
+            f.write(header)
+            tile = np.empty((len(modes), 2, B, B), dtype='<f4')
+            for I in range(m):
+                rows = np.arange(I*B, min((I + 1)*B, n))
+                for J in range(I + 1):
+                    cols = np.arange(J*B, min((J + 1)*B, n))
+                    block = get_block(rows, cols)
+                    tile.fill(np.nan)
+                    for k, mode in enumerate(modes):
+                        costs, times = block[mode]
+                        tile[k, 0, :len(rows), :len(cols)] = costs
+                        tile[k, 1, :len(rows), :len(cols)] = times
+                    f.write(tile.tobytes())
+        os.replace(tmp_path, path)
+
+    def get_tile(self, I, J):
+        """
+        Return the memory-mapped tile (I, J) (of shape
+        (modes, 2, block size, block size)) of the full matrix,
+        transposing the stored tile (J, I) if ``I < J``.
+        """
+        if I >= J:
+            return self.tiles[I*(I + 1)//2 + J]
+        return self.tiles[J*(J + 1)//2 + I].swapaxes(2, 3)
+
+    def round(self, costs, times):
+        """
+        Given float32 arrays of costs and times read from the file,
+        return them as float64 arrays rounded as in the JSON format.
+        """
+        return (round_array(costs.astype(float), self.cost_digits),
+          round_array(times.astype(float), self.time_digits))
+
+    def get(self, origin, destination, mode):
+        """
+        Return the round-trip cost in dollars and time in hours
+        of the commute by the given mode between the area units with the
+        given names.
+        Return ``(None, None)`` if the commute is unavailable.
+        """
+        B = self.block_size
+        i = self.index_by_name[origin]
+        j = self.index_by_name[destination]
+        i, j = max(i, j), min(i, j)
+        tile = self.get_tile(i // B, j // B)
+        k = self.modes.index(mode)
+        cost = float(tile[k, 0, i % B, j % B])
+        if cost != cost:
+            return None, None
+        return (round(cost, self.cost_digits),
+          round(float(tile[k, 1, i % B, j % B]), self.time_digits))
+
+    def get_row(self, origin, mode):
+        """
+        Return the pair (costs, times) of NumPy arrays of the round-trip
+        commute costs and times by the given mode between the area
+        unit with the given name and every area unit,
+        in index order, with NaN for missing commutes.
+        Reads one block row of tiles.
+        """
+        B = self.block_size
+        i = self.index_by_name[origin]
+        k = self.modes.index(mode)
+        m = -(-len(self) // B)
+        a = np.concatenate([self.get_tile(i // B, J)[k, :, i % B, :]
+          for J in range(m)], axis=1)[:, :len(self)]
+        return self.round(a[0], a[1])
+
+    def get_submatrix(self, names, modes=None):
+        """
+        Return the ``CommuteMatrix`` of the commutes by the given modes
+        (defaulting to all) between the area units with the given names,
+        indexed in sorted order of name as in the region commute costs
+        files.
+        Only reads the tiles that contain those commutes.
+        """
+        if modes is None:
+            modes = self.modes
+        names = sorted(names)
+        B = self.block_size
+        indices = np.array([self.index_by_name[name] for name in names],
+          dtype=int)
+        rows, cols = np.tril_indices(len(names))
+        # Entry (r, c) of the submatrix with r >= c lies in the full matrix
+        # at (i, j) with i >= j
+        i = np.maximum(indices[rows], indices[cols])
+        j = np.minimum(indices[rows], indices[cols])
+        costs_by_mode = {mode: np.empty(len(rows), dtype='<f4')
+          for mode in modes}
+        times_by_mode = {mode: np.empty(len(rows), dtype='<f4')
+          for mode in modes}
+        tile_indices = (i // B)*(i // B + 1)//2 + j // B
+        order = np.argsort(tile_indices, kind='stable')
+        bounds = np.flatnonzero(np.diff(tile_indices[order])) + 1
+        for group in np.split(order, bounds):
+            tile = self.tiles[tile_indices[group[0]]]
+            r = i[group] % B
+            c = j[group] % B
+            for mode in modes:
+                k = self.modes.index(mode)
+                costs_by_mode[mode][group] = tile[k, 0, r, c]
+                times_by_mode[mode][group] = tile[k, 1, r, c]
+        index_by_name = {name: r for (r, name) in enumerate(names)}
+        return CommuteMatrix(index_by_name, costs_by_mode, times_by_mode,
+          self.cost_digits, self.time_digits)
+
+    def get_region_matrix(self, region, modes=None):
+        """
+        Return the submatrix (see ``get_submatrix()``) of the area units
+        of the given ``Region``.
+        """
+        return self.get_submatrix(region.get_area_units(), modes)
+
+def create_national_commute_costs(path=NATIONAL_COMMUTE_COSTS_FILE,
+  get_costs=get_bird_commute_costs, block_size=BLOCK_SIZE,
+  shapes_path=MASTER_SHAPES_FILE):
+    """
+    Build the national commute matrix of all the area units in the
+    master shapes file at ``shapes_path`` and save it as a tiled
+    commute matrix file at the given path (see ``TiledCommuteMatrix``),
+    with area units in the order of ``get_national_order()``.
+
+    Compute the commutes between the centroids of the area units
+    (see ``get_national_centroids()``) a tile at a time with
+    ``get_costs(a, b)``, which takes m x 2 and k x 2 arrays of
+    longitude-latitude points and returns a dictionary
+    mode -> (costs, times) of m x k arrays of round-trip costs and times.
+    It defaults to ``get_bird_commute_costs()``, so that the commutes
+    within a region agree with its fake commute costs.
+    Memory use is thus bounded by the size of a tile, not of the matrix.
+
+    Return the resulting ``TiledCommuteMatrix``.
+    """
+    centroid_by_name = get_national_centroids(shapes_path, block_size)
+    names = get_national_order(centroid_by_name)
+    points = np.array([centroid_by_name[name] for name in names])
+
+    def get_block(rows, cols):
+        return get_costs(points[rows], points[cols])
+
+    TiledCommuteMatrix.write(path, names, get_block, MODES, block_size)
+    return TiledCommuteMatrix(path)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build and read the '
+      'national commute matrix of New Zealand.')
+    subparsers = parser.add_subparsers(dest='command')
+
+    p = subparsers.add_parser('build', help='build the national commute '
+      'matrix; see create_national_commute_costs()')
+    p.add_argument('-o', '--out', default=NATIONAL_COMMUTE_COSTS_FILE)
+    p.add_argument('-b', '--block-size', type=int, default=BLOCK_SIZE)
+
+    p = subparsers.add_parser('extract', help='save the submatrix of a '
+      'region as a binary commute matrix; see region.CommuteMatrix')
+    p.add_argument('region', choices=sorted(REGIONS))
+    p.add_argument('out', help='path of the binary commute matrix file')
+    p.add_argument('-i', '--in', dest='in_path',
+      default=NATIONAL_COMMUTE_COSTS_FILE)
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        matrix = create_national_commute_costs(args.out,
+          block_size=args.block_size)
+        print('Built the commute matrix of {!s} area units in {!s}'.format(
+          len(matrix), args.out))
+    elif args.command == 'extract':
+        matrix = TiledCommuteMatrix(args.in_path).get_region_matrix(
+          Region('data/' + args.region + '/'))
+        matrix.dump_binary(args.out)
+    else:
+        parser.print_help()
@@ -0,0 +1,357 @@
+"""
+``routing.py``
+
+This module computes the commute CSV files of a region
+(see ``region.py``) from a road network, for regions whose commutes
+were not produced elsewhere.
+
+It loads a road network from an OpenStreetMap (OSM) XML extract on
+disk (by default ``roads.osm`` in the region's directory; see
+`here <https://wiki.openstreetmap.org/wiki/OSM_XML>`_), builds a compact
+graph of it for each mode, and finds the quickest paths from the
+centroid of each area unit to the centroids of all the others,
+in parallel across origins.
+Run ``python routing.py R`` to create the walk, bicycle, and car
+commute CSV files of region ``R``; see ``python routing.py --help``
+for options.
+Transit commutes need timetables and are not computed.
+"""
+import csv
+import os
+import gzip
+import heapq
+import argparse
+import xml.etree.ElementTree as ET
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import shapely
+
+from region import REGIONS, Region, distance, pj_nztm
+
+ROUTING_MODES = ['walk', 'bicycle', 'car']
+# Speeds in kilometers per hour
+WALK_SPEED = 5
+BICYCLE_SPEED = 15
+CAR_SPEED_BY_HIGHWAY = {
+  'motorway': 100, 'motorway_link': 60, 'trunk': 80, 'trunk_link': 50,
+  'primary': 60, 'primary_link': 40, 'secondary': 50,
+  'secondary_link': 40, 'tertiary': 50, 'tertiary_link': 30,
+  'unclassified': 40, 'road': 30, 'residential': 30, 'living_street': 10,
+  'service': 15,
+  }
+# Kilometers per mile, for OSM 'maxspeed' tags in miles per hour
+KM_PER_MILE = 1.609344
+# Values of the OSM 'highway' tag of the ways usable by each mode
+HIGHWAYS_BY_MODE = {
+  'walk': set(CAR_SPEED_BY_HIGHWAY) - {'motorway', 'motorway_link',
+    'trunk', 'trunk_link'} | {'footway', 'path', 'pedestrian', 'steps',
+    'track', 'cycleway', 'bridleway'},
+  'bicycle': set(CAR_SPEED_BY_HIGHWAY) - {'motorway', 'motorway_link'} |
+    {'path', 'track', 'cycleway'},
+  'car': set(CAR_SPEED_BY_HIGHWAY),
+  }
+# OSM access tag of each mode
+ACCESS_TAG_BY_MODE = {'walk': 'foot', 'bicycle': 'bicycle',
+  'car': 'motor_vehicle'}
+
+def read_osm(path):
+    """
+    Stream through the OSM XML file (optionally gzipped) at the given
+    path and return the triple (node IDs, points, ways), where
+    ``node IDs`` is a sorted NumPy array of the IDs of the nodes,
+    ``points`` is the corresponding n x 2 array of their WGS84
+    longitudes and latitudes, and ``ways`` is the list of pairs
+    (list of node IDs, dictionary of tags) of the ways tagged 'highway'.
+
+    Clear the root element after each top-level element is handled,
+    since the parser otherwise keeps every (emptied) element attached
+    to the root, so that memory would grow with the file.
+    """
+    ids = array('q')
+    lons = array('d')
+    lats = array('d')
+    ways = []
+    root = None
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'rb') as f:
+        for event, element in ET.iterparse(f, events=('start', 'end')):
+            if event == 'start':
+                if root is None:
+                    root = element
+                continue
+            if element.tag == 'node':
+                ids.append(int(element.get('id')))
+                lons.append(float(element.get('lon')))
+                lats.append(float(element.get('lat')))
+            elif element.tag == 'way':
+                tags = {tag.get('k'): tag.get('v')
+                  for tag in element.iter('tag')}
+                if 'highway' in tags:
+                    ways.append(([int(nd.get('ref'))
+                      for nd in element.iter('nd')], tags))
+            elif element.tag != 'relation':
+                continue
+            root.clear()
+    ids = np.frombuffer(ids, dtype=np.int64)
+    order = np.argsort(ids)
+    points = np.column_stack([np.frombuffer(lons), np.frombuffer(lats)])
+    return ids[order], points[order], ways
+
+def parse_maxspeed(value):
+    """
+    Return the speed in kilometers per hour given by the OSM 'maxspeed'
+    tag value, which is in kilometers per hour unless suffixed 'mph',
+    or ``None`` if the value is not a finite positive speed, e.g. '0',
+    'nan', 'none', 'signals', or 'NZ:urban'.
+    """
+    value = value.strip().lower()
+    factor = 1
+    if value.endswith('mph'):
+        value = value[:-3]
+        factor = KM_PER_MILE
+    elif value.endswith('km/h'):
+        value = value[:-4]
+    try:
+        speed = factor*float(value)
+    except ValueError:
+        return None
+    if not 0 < speed < float('inf'):
+        return None
+    return speed
+
+def get_way_speed(tags, mode):
+    """
+    Return the speed in kilometers per hour at which the given mode
+    travels along the way with the given OSM tags, or ``None`` if the
+    mode may not use the way.
+    For cars, use the way's 'maxspeed' tag if it gives a valid speed
+    (see ``parse_maxspeed()``) and ``CAR_SPEED_BY_HIGHWAY`` otherwise.
+    """
+    if tags['highway'] not in HIGHWAYS_BY_MODE[mode] or\
+      tags.get(ACCESS_TAG_BY_MODE[mode]) == 'no' or\
+      tags.get('access') in ('no', 'private') and\
+      tags.get(ACCESS_TAG_BY_MODE[mode]) not in ('yes', 'designated'):
+        return None
+    if mode == 'walk':
+        return WALK_SPEED
+    if mode == 'bicycle':
+        return BICYCLE_SPEED
+    speed = parse_maxspeed(tags.get('maxspeed', ''))
+    if speed is None:
+        return CAR_SPEED_BY_HIGHWAY[tags['highway']]
+    return speed
+
+def get_way_direction(tags, mode):
+    """
+    Return 1 if the given mode may travel along the way with the given
+    OSM tags only in the direction of its nodes, -1 if only in the
+    opposite direction, and 0 if in both directions.
+    Pedestrians ignore one-way restrictions.
+    """
+    if mode == 'walk' or mode == 'bicycle' and\
+      tags.get('oneway:bicycle') == 'no':
+        return 0
+    oneway = tags.get('oneway')
+    if oneway in ('yes', 'true', '1') or (oneway is None and
+      tags.get('junction') == 'roundabout'):
+        return 1
+    if oneway == '-1':
+        return -1
+    return 0
+
+class Graph(object):
+    """
+    Represents the road network of a mode as a directed graph in
+    compressed sparse row (CSR) form: the edges leaving node ``u`` are
+    the edges ``k`` with ``indptr[u] <= k < indptr[u + 1]``, and edge
+    ``k`` leads to node ``indices[k]``, has length ``lengths[k]``
+    in kilometers, and takes ``times[k]`` hours.
+    The nodes have WGS84 longitude-latitude coordinates ``points``.
+    """
+    def __init__(self, indptr, indices, lengths, times, points):
+        self.indptr = indptr
+        self.indices = indices
+        self.lengths = lengths
+        self.times = times
+        self.points = points
+
+    def __len__(self):
+        return len(self.points)
+
+    @classmethod
+    def from_osm(cls, ids, points, ways, mode):
+        """
+        Build the graph of the given mode from the output of
+        ``read_osm()``, keeping only the nodes on ways usable by the mode
+        (see ``get_way_speed()`` and ``get_way_direction()``).
+        Skip the segments of ways with nodes missing from the extract.
+        """
+        sources = []
+        targets = []
+        speeds = []
+        for node_ids, tags in ways:
+            speed = get_way_speed(tags, mode)
+            if speed is None or len(node_ids) < 2:
+                continue
+            direction = get_way_direction(tags, mode)
+            if direction >= 0:
+                sources.extend(node_ids[:-1])
+                targets.extend(node_ids[1:])
+                speeds.extend([speed]*(len(node_ids) - 1))
+            if direction <= 0:
+                sources.extend(node_ids[1:])
+                targets.extend(node_ids[:-1])
+                speeds.extend([speed]*(len(node_ids) - 1))
+        # Convert node IDs to row indices of ``points``
+        u = np.searchsorted(ids, sources)
+        v = np.searchsorted(ids, targets)
+        u[u == len(ids)] = 0
+        v[v == len(ids)] = 0
+        found = (ids[u] == sources) & (ids[v] == targets)
+        u, v = u[found], v[found]
+        speeds = np.array(speeds, dtype=float)[found]
+        # Keep only the nodes on edges
+        nodes, uv = np.unique(np.concatenate([u, v]), return_inverse=True)
+        u, v = uv[:len(u)], uv[len(u):]
+        points = points[nodes]
+        lengths = distance(points[u, 0], points[u, 1], points[v, 0],
+          points[v, 1])
+        order = np.argsort(u, kind='stable')
+        indptr = np.concatenate([[0],
+          np.cumsum(np.bincount(u, minlength=len(nodes)))])
+        return cls(indptr, v[order], lengths[order],
+          lengths[order]/speeds[order], points)
+
+    def get_nearest_nodes(self, points):
+        """
+        Given an m x 2 array-like of WGS84 longitude-latitude points,
+        return the array of the indices of the nodes nearest to them,
+        measuring distance in NZTM coordinates.
+        """
+        points = np.asarray(points, dtype=float)
+        x, y = pj_nztm(self.points[:, 0], self.points[:, 1])
+        tree = shapely.STRtree(shapely.points(x, y))
+        x, y = pj_nztm(points[:, 0], points[:, 1])
+        return tree.nearest(shapely.points(x, y))
+
+    def get_quickest_paths(self, source, targets):
+        """
+        Run Dijkstra's algorithm from the given source node,
+        stopping once all the given target nodes are reached, and return
+        the pair (distances, times) of lists of the lengths in kilometers
+        and times in hours of the quickest paths from the source to the
+        targets, with ``None`` for unreachable targets.
+        """
+        indptr = self.indptr
+        indices = self.indices
+        lengths = self.lengths
+        times = self.times
+        inf = float('inf')
+        best = [inf]*len(self)
+        done = [False]*len(self)
+        path_length = {}
+        remaining = set(targets)
+        best[source] = 0.0
+        heap = [(0.0, 0.0, source)]
+        while heap and remaining:
+            t, d, u = heapq.heappop(heap)
+            if done[u]:
+                continue
+            done[u] = True
+            path_length[u] = d
+            remaining.discard(u)
+            for k in range(indptr[u], indptr[u + 1]):
+                v = indices[k]
+                s = t + times[k]
+                if s < best[v]:
+                    best[v] = s
+                    heapq.heappush(heap, (s, d + lengths[k], v))
+        return ([path_length.get(v) for v in targets],
+          [best[v] if done[v] else None for v in targets])
+
+    def to_lists(self):
+        """
+        Return a copy of this graph whose arrays are Python lists,
+        which are quicker to index one item at a time in
+        ``get_quickest_paths()``.
+        """
+        return Graph(self.indptr.tolist(), self.indices.tolist(),
+          self.lengths.tolist(), self.times.tolist(), self.points)
+
+# Graph of the worker processes of ``create_commutes()``
+worker_graph = None
+
+def init_worker(graph):
+    global worker_graph
+    worker_graph = graph.to_lists()
+
+def get_commute_rows(source, targets):
+    """
+    Return the pair (distances, times) of ``get_quickest_paths()``
+    on the graph of this worker process.
+    """
+    return worker_graph.get_quickest_paths(source, targets)
+
+def create_commutes(region, osm_path=None, modes=ROUTING_MODES,
+  num_workers=None):
+    """
+    Create the commute CSV files of the given ``Region`` for the given
+    modes (from ``ROUTING_MODES``) from the OSM extract at the given
+    path (defaulting to the region's ``roads.osm`` file).
+    For each mode, build its graph (see ``Graph.from_osm()``),
+    snap the centroids of the area units to their nearest nodes,
+    and find the quickest paths between them in parallel across origins
+    with at most ``num_workers`` processes (defaulting to the number
+    of CPUs).
+    Write distances in kilometers and times in hours to 3 decimal places,
+    with empty values for unreachable destinations, in the format of
+    the commute CSV files read by ``Region.iter_commutes()``.
+    The commute from an area unit to itself takes no distance or time.
+
+    Snapping ignores the distance from a centroid to its node, so an
+    extract should cover the region's centroids with its roads.
+    """
+    assert set(modes) <= set(ROUTING_MODES),\
+      "Modes must lie in {!s}".format(ROUTING_MODES)
+    if osm_path is None:
+        osm_path = region.path_by_data['roads']
+    ids, points, ways = read_osm(osm_path)
+    centroid_by_name = region.get_centroids_dict()
+    names = sorted(centroid_by_name)
+    for mode in modes:
+        graph = Graph.from_osm(ids, points, ways, mode)
+        nodes = graph.get_nearest_nodes(
+          [centroid_by_name[name] for name in names]).tolist()
+        with ProcessPoolExecutor(max_workers=num_workers,
+          initializer=init_worker, initargs=(graph,)) as executor:
+            results = executor.map(get_commute_rows, nodes,
+              [nodes]*len(nodes), chunksize=8)
+            with open(region.path_by_data[mode + '_commutes'], 'w') as f:
+                writer = csv.writer(f)
+                writer.writerow(['origin area unit', 'destination area unit',
+                  'distance (kilometers)', 'time (hours)'])
+                for origin, (distances, times) in zip(names, results):
+                    for destination, d, t in zip(names, distances, times):
+                        if origin == destination:
+                            d, t = 0.0, 0.0
+                        writer.writerow([origin, destination,
+                          '' if d is None else round(d, 3),
+                          '' if t is None else round(t, 3)])
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Create the commute CSV '
+      'files of a region of New Zealand from an OpenStreetMap extract.')
+    parser.add_argument('region', choices=sorted(REGIONS))
+    parser.add_argument('-o', '--osm', default=None,
+      help='path of the OSM XML extract (optionally gzipped); '
+      'defaults to roads.osm in the region directory')
+    parser.add_argument('-m', '--modes', nargs='+', choices=ROUTING_MODES,
+      default=ROUTING_MODES)
+    parser.add_argument('-w', '--workers', type=int, default=None,
+      help='number of worker processes; defaults to the number of CPUs')
+    args = parser.parse_args()
+
+    create_commutes(Region(os.path.join('data', args.region) + '/'),
+      args.osm, args.modes, args.workers)
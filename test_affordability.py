@@ -0,0 +1,61 @@
+"""
+Regression tests of ``affordability.py``, run with ``python -m pytest``.
+
+The ``region`` fixture is a small synthetic region; see ``conftest.py``.
+"""
+import numpy as np
+import pytest
+
+from region import MODES
+from affordability import MAX_BEDROOMS, Commute, AffordabilityModel,\
+  create_affordability_tables, read_affordability_table,\
+  get_scenario_grid, create_scenario_sweep
+
+@pytest.fixture
+def model(region):
+    region.create_commute_costs()
+    region.improve_transit_commute_costs()
+    return AffordabilityModel.from_region(region)
+
+def get_scenarios(model):
+    return get_scenario_grid(income=[20000, 55000],
+      work_area_unit=[None, model.names[0], model.names[-4]],
+      mode=MODES, num_workdays=[3, 5], parking_cost=[0, 12.5],
+      num_bedrooms=[1, 3], num_bedrooms_rent=[1, 2], num_cars=[0, 1])
+
+def test_evaluate_scenarios_matches_one_at_a_time(model):
+    scenarios = get_scenarios(model)
+    fractions = model.evaluate_scenarios(scenarios, chunk_size=50,
+      num_workers=2)
+    assert fractions.shape == (len(scenarios['income']), len(model))
+    for s in range(len(scenarios['income'])):
+        scenario = {field: values[s] for field, values in scenarios.items()}
+        commutes = [Commute(scenario['work_area_unit'] or None,
+          scenario['mode'], scenario['num_workdays'],
+          scenario['parking_cost'])]
+        expected = model.get_weekly_total_cost_fractions(
+          scenario['income'], commutes, scenario['num_bedrooms'],
+          scenario['num_bedrooms_rent'], scenario['num_cars'])
+        np.testing.assert_allclose(fractions[s], expected, rtol=1e-6)
+
+def test_affordability_tables_match_model(region, model):
+    create_affordability_tables(region)
+    for work_area_unit in model.names[::9]:
+        table = read_affordability_table(region, work_area_unit)
+        for k, mode in enumerate(MODES):
+            for b in range(1, MAX_BEDROOMS + 1):
+                expected = model.get_weekly_total_costs(
+                  [Commute(work_area_unit, mode)], b, 1,
+                  int(mode == 'car'))
+                np.testing.assert_allclose(table[k, b - 1], expected,
+                  rtol=1e-6)
+
+def test_scenario_sweep_round_trip(region, model):
+    scenarios = get_scenarios(model)
+    path = create_scenario_sweep(region, scenarios)
+    with np.load(path) as data:
+        assert data['names'].tolist() == model.names
+        np.testing.assert_array_equal(data['fractions'],
+          model.evaluate_scenarios(scenarios))
+        assert data['work_area_unit'].tolist() ==\
+          [x or '' for x in scenarios['work_area_unit']]
@@ -0,0 +1,210 @@
+"""
+Regression tests of ``region.py``, run with ``python -m pytest``.
+
+The reference functions below are the loops of the original
+dictionary-based code, which the vectorized code must match exactly.
+The ``region`` fixture is a small synthetic region; see ``conftest.py``.
+"""
+import csv
+import os
+
+import numpy as np
+import pytest
+
+from region import MODES, NAME_FIELD, COMMUTE_COST_PER_KM_BY_MODE,\
+  CommuteMatrix, load_json, get_bird_distance_and_time, get_centroids,\
+  get_half_index, round_array
+
+def get_reference_commute_costs(region):
+    """
+    Return the commute costs half-matrices of the given region as
+    computed by the original ``Region.create_commute_costs()``.
+    """
+    names = region.get_area_units()
+    index_by_name = {name: i for (i, name) in enumerate(sorted(names))}
+    n = len(names)
+    M = {mode: [[(None, None) for j in range(n)] for i in range(n)]
+      for mode in MODES}
+    for mode in MODES:
+        with open(region.path_by_data[mode + '_commutes']) as f:
+            reader = csv.reader(f)
+            next(reader)
+            for o_name, d_name, distance, time in reader:
+                distance = float(distance) if distance else None
+                time = float(time) if time else None
+                M[mode][index_by_name[o_name]][index_by_name[d_name]] =\
+                  (distance, time)
+    MM = {mode: [[[None, None] for j in range(i + 1)] for i in range(n)]
+      for mode in MODES}
+    for mode in MODES:
+        for i in range(n):
+            for j in range(i + 1):
+                try:
+                    distance = M[mode][i][j][0] + M[mode][j][i][0]
+                    time = M[mode][i][j][1] + M[mode][j][i][1]
+                    MM[mode][i][j] = [
+                      round(COMMUTE_COST_PER_KM_BY_MODE[mode]*distance, 2),
+                      round(time, 2)]
+                except TypeError:
+                    pass
+    return {'index_by_name': index_by_name, 'matrix': MM}
+
+def get_reference_fake_commute_costs(region):
+    """
+    Return the fake commute costs half-matrices of the given region as
+    computed by the original ``Region.create_fake_commute_costs()``.
+    """
+    centroid_by_name = region.get_centroids_dict()
+    names = sorted(region.get_area_units())
+    index_by_name = {name: i for (i, name) in enumerate(names)}
+    n = len(names)
+    factor_by_mode = {'walk': 15, 'bicycle': 4, 'car': 1, 'transit': 1}
+    MM = {mode: [[None for j in range(i + 1)] for i in range(n)]
+      for mode in MODES}
+    for i in range(n):
+        for j in range(i + 1):
+            a = centroid_by_name[names[i]]
+            b = centroid_by_name[names[j]]
+            legs = [[round(x, 2) for x in get_bird_distance_and_time(u, v)]
+              for (u, v) in [(a, b), (b, a)]]
+            distance = legs[0][0] + legs[1][0]
+            for mode in MODES:
+                time = factor_by_mode[mode]*legs[0][1] +\
+                  factor_by_mode[mode]*legs[1][1]
+                MM[mode][i][j] = [
+                  round(COMMUTE_COST_PER_KM_BY_MODE[mode]*distance, 2),
+                  round(time, 1)]
+    return {'index_by_name': index_by_name, 'matrix': MM}
+
+def apply_reference_fares(region, data):
+    """
+    Apply the monthly pass fares of the given region to the transit
+    costs of the given decoded commute costs in place, as the original
+    ``improve_auckland_transit_commute_costs()`` did.
+    """
+    centroids = load_json(region.path_by_data['centroids'])
+    zone_by_name = {f['properties'][NAME_FIELD]: f['properties']['fare_zone']
+      for f in centroids['features']}
+    cost_by_od = {}
+    with open(region.path_by_data['monthly_pass_fares']) as f:
+        reader = csv.reader(f)
+        next(reader)
+        for origin, destination, monthly_cost in reader:
+            cost_by_od[(origin, destination)] = float(monthly_cost)/(365/12)\
+              if monthly_cost != '' else None
+    M = data['matrix']
+    name_by_index = {i: name for (name, i) in data['index_by_name'].items()}
+    for i in range(len(M['transit'])):
+        i_zone = zone_by_name[name_by_index[i]]
+        for j in range(i + 1):
+            j_zone = zone_by_name[name_by_index[j]]
+            try:
+                cost = round(cost_by_od[(i_zone, j_zone)] +
+                  cost_by_od[(j_zone, i_zone)], 2)
+            except (KeyError, TypeError):
+                cost = None
+            if cost is not None and M['transit'][i][j][0] not in [None, 0]:
+                M['transit'][i][j][0] = cost
+
+def assert_matrices_equal(a, b):
+    assert a.index_by_name == b.index_by_name
+    assert a.modes == b.modes
+    for mode in a.modes:
+        for x, y in zip(a.get_arrays(mode), b.get_arrays(mode)):
+            np.testing.assert_array_equal(x, y)
+
+def test_commute_costs_match_original(region):
+    region.create_commute_costs()
+    assert load_json(region.path_by_data['commute_costs']) ==\
+      get_reference_commute_costs(region)
+    assert_matrices_equal(region.get_commute_matrix(),
+      CommuteMatrix.from_json(region.path_by_data['commute_costs']))
+
+def test_fake_commute_costs_match_original(region):
+    region.create_fake_commute_costs()
+    assert load_json(region.path_by_data['fake_commute_costs']) ==\
+      get_reference_fake_commute_costs(region)
+
+def test_transit_fares_match_original(region):
+    region.create_commute_costs()
+    expected = get_reference_commute_costs(region)
+    apply_reference_fares(region, expected)
+    region.improve_transit_commute_costs()
+    region.merge_commute_costs_delta()
+    assert load_json(region.path_by_data['commute_costs']) == expected
+    assert region.is_commute_binary_current()
+    assert_matrices_equal(region.get_commute_matrix(),
+      CommuteMatrix.from_json(region.path_by_data['commute_costs']))
+
+def test_commute_costs_update_matches_rebuild(region):
+    region.create_commute_costs()
+    path = region.path_by_data['walk_commutes']
+    with open(path) as f:
+        rows = list(csv.reader(f))
+    for row in rows[3:9]:
+        row[2] = '{:.3f}'.format(2*float(row[2] or 1))
+        row[3] = '{:.3f}'.format(0.5)
+    with open(path, 'w') as f:
+        csv.writer(f).writerows(rows)
+
+    count_by_mode = region.update_commute_costs(['walk'])
+    assert 0 < count_by_mode['walk'] < 12
+    assert os.path.isfile(region.path_by_data['commute_costs_delta'])
+    updated = region.get_commute_matrix()
+    expected = get_reference_commute_costs(region)
+    assert updated.to_json_dict() == expected
+
+    # Reading the JSON file with its delta gives the same
+    os.remove(region.path_by_data['commute_costs_binary'])
+    assert region.get_commute_matrix().to_json_dict() == expected
+    assert region.merge_commute_costs_delta()
+    assert load_json(region.path_by_data['commute_costs']) == expected
+
+def test_stale_binary_commute_costs_are_ignored(region):
+    region.create_commute_costs()
+    assert region.is_commute_binary_current()
+    matrix = CommuteMatrix.from_json(region.path_by_data['commute_costs'])
+    costs, times = matrix.get_arrays('car')
+    matrix.costs_by_mode['car'] = round_array(costs + 1, 2)
+    region.save_commute_matrix(matrix, formats=('json',))
+    assert not region.is_commute_binary_current()
+    assert_matrices_equal(region.get_commute_matrix(), matrix)
+    region.save_commute_matrix(matrix)
+    assert region.is_commute_binary_current()
+    assert_matrices_equal(region.get_commute_matrix(), matrix)
+
+@pytest.mark.parametrize('max_time', [None, 1])
+def test_sparse_commute_matrix_round_trip(region, max_time):
+    region.create_commute_costs()
+    dense = region.get_commute_matrix()
+    sparse = region.create_sparse_commute_costs(max_time=max_time)
+    loaded = region.get_sparse_commute_matrix()
+    assert loaded.to_json_dict() == sparse.to_json_dict()
+
+    names = sorted(dense.index_by_name, key=dense.index_by_name.get)
+    result = loaded.to_commute_matrix()
+    for mode in dense.modes:
+        costs, times = dense.get_arrays(mode)
+        if max_time is not None:
+            keep = times <= max_time
+            costs = np.where(keep, costs, np.nan)
+            times = np.where(keep, times, np.nan)
+        np.testing.assert_array_equal(result.get_arrays(mode)[0], costs)
+        np.testing.assert_array_equal(result.get_arrays(mode)[1], times)
+        for origin in names[::7]:
+            for destination in names[::5]:
+                k = get_half_index(dense.index_by_name[origin],
+                  dense.index_by_name[destination])
+                expected = (None, None) if costs[k] != costs[k] else\
+                  (costs[k], times[k])
+                assert loaded.get(origin, destination, mode) == expected
+
+def test_centroids_of_empty_shapes_fail(region):
+    collection = region.get_shapes()
+    centroids = get_centroids(collection)
+    assert [f['properties'] for f in centroids['features']] ==\
+      [f['properties'] for f in collection['features']]
+    collection['features'][3]['geometry'] = {'type': 'Polygon',
+      'coordinates': []}
+    with pytest.raises(AssertionError):
+        get_centroids(collection)
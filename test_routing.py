@@ -0,0 +1,42 @@
+"""
+Tests of ``routing.py``, run with ``python -m pytest``.
+"""
+import pytest
+
+from routing import CAR_SPEED_BY_HIGHWAY, KM_PER_MILE, parse_maxspeed,\
+  get_way_speed, read_osm
+
+OSM = """<?xml version="1.0"?>
+<osm version="0.6">
+ <bounds minlat="-41.3" minlon="174.7" maxlat="-41.2" maxlon="174.8"/>
+ <node id="3" lat="-41.21" lon="174.71"><tag k="highway" v="crossing"/></node>
+ <node id="1" lat="-41.22" lon="174.72"/>
+ <node id="2" lat="-41.23" lon="174.73"/>
+ <way id="10"><nd ref="1"/><nd ref="2"/><nd ref="3"/>
+  <tag k="highway" v="residential"/><tag k="maxspeed" v="50"/></way>
+ <way id="11"><nd ref="1"/><nd ref="3"/><tag k="building" v="yes"/></way>
+ <relation id="20"><member type="way" ref="10" role=""/></relation>
+</osm>
+"""
+
+@pytest.mark.parametrize('value, speed', [('50', 50), (' 80 km/h', 80),
+  ('30 mph', 30*KM_PER_MILE), ('0', None), ('-20', None), ('nan', None),
+  ('inf', None), ('none', None), ('NZ:urban', None), ('50;30', None)])
+def test_parse_maxspeed(value, speed):
+    assert parse_maxspeed(value) == speed
+
+def test_get_way_speed_falls_back_to_highway_default():
+    tags = {'highway': 'primary', 'maxspeed': '0'}
+    assert get_way_speed(tags, 'car') == CAR_SPEED_BY_HIGHWAY['primary']
+    tags['maxspeed'] = '40 mph'
+    assert get_way_speed(tags, 'car') == 40*KM_PER_MILE
+
+def test_read_osm(tmp_path):
+    path = tmp_path/'roads.osm'
+    path.write_text(OSM)
+    ids, points, ways = read_osm(str(path))
+    assert ids.tolist() == [1, 2, 3]
+    assert points.tolist() == [[174.72, -41.22], [174.73, -41.23],
+      [174.71, -41.21]]
+    assert ways == [([1, 2, 3], {'highway': 'residential',
+      'maxspeed': '50'})]
@@ -0,0 +1,300 @@
+"""
+``tiles.py``
+
+This module pre-renders the web map of a region of New Zealand
+(see ``rapyd/map.pyj``) for default scenarios, so that the map can
+show a cached choropleth as soon as it loads and recolor the area
+units itself only once the user changes a setting.
+
+For each default scenario, it colors the area units of the region by
+their weekly total cost of living as a fraction of income
+(see ``affordability.py``), with the bins and colors of the web map,
+and writes the result as a pyramid of z/x/y vector tiles in the
+`slippy map <https://wiki.openstreetmap.org/wiki/Slippy_map_tilenames>`_
+scheme, each a compact GeoJSON feature collection of the area unit
+shapes clipped to the tile.
+Shapes are simplified once per zoom level by their shared boundaries
+(see ``topology.py``) to about a pixel, and zoom levels are rendered in
+parallel.
+Run ``python tiles.py R`` to render the tiles of region ``R``;
+see ``python tiles.py --help`` for options.
+"""
+import os
+import math
+import argparse
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import shapely
+from shapely.geometry import shape, mapping
+
+from region import REGIONS, NAME_FIELD, Region, dump_json,\
+  get_polygon_by_property, assign_points_to_polygons
+from affordability import MAX_BEDROOMS, AffordabilityModel, Commute
+from topology import build_topology, simplify_arcs, topology_to_geojson
+
+# Zoom levels of the web map, as in ``rapyd/map.pyj``
+TILE_ZOOMS = list(range(8, 14))
+# Width of a tile in pixels
+TILE_SIZE = 256
+# Width in pixels of the margin of the tile bounds to which shapes are
+# clipped, so that area unit outlines do not show seams at tile edges
+TILE_BUFFER = 4
+# Bins, labels, and colors of cost fractions, as in ``rapyd/map.pyj``,
+# with the no-data color first
+BINS = [0, 0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 10e9]
+LABELS = ['n/a', '10%', '20%', '30%', '40%', '50%', '60%', '70%',
+  '80%', '90%', '100%+']
+COLORS = ['#c8c8c8', '#5e4fa2', '#3288bd', '#66c2a5', '#abdda4',
+  '#e6f598', '#fee08b', '#fdae61', '#f46d43', '#d53e4f', '#9e0142']
+# WGS84 (lat, lon) of the work marker and median annual income
+# of the web map of each region, as in ``rapyd/<region>.pyml``
+# (``rapyd/index.pyml`` for Auckland)
+WORK_LAT_LON_BY_REGION = {
+  'auckland': (-36.74, 175.07),
+  'canterbury': (-43.5, 172.8),
+  'nelson': (-41.25, 173.21),
+  'otago': (-46.02, 170.35),
+  'waikato': (-37.77, 174.94),
+  'wellington': (-41.21, 174.63),
+  }
+MEDIAN_ANNUAL_INCOME_BY_REGION = {
+  'auckland': 45864,
+  'canterbury': 43316,
+  'nelson': 39000,
+  'otago': 42120,
+  'waikato': 40976,
+  'wellington': 47892,
+  }
+
+# The settings of the web map that determine the colors of the area
+# units, namely the annual income, the commutes (a list of
+# ``affordability.Commute`` objects), the number of bedrooms of the
+# dwelling, the number of those bedrooms to rent, and the number of cars
+# owned
+Scenario = namedtuple('Scenario', ['income', 'commutes', 'num_bedrooms',
+  'num_bedrooms_rent', 'num_cars'])
+
+def get_colors(fractions):
+    """
+    Return the list of colors (from ``COLORS``) of the given NumPy array
+    of cost fractions, as ``getColor()`` in ``rapyd/map.pyj`` does,
+    that is, the color of the first bin at least the fraction,
+    and the no-data color for NaNs and fractions beyond the last bin.
+    """
+    i = np.searchsorted(BINS, fractions, side='left')
+    i[i == len(BINS)] = 0
+    return [COLORS[j] for j in i.tolist()]
+
+def get_default_scenarios(region):
+    """
+    Return a dictionary with structure
+    scenario name -> ``Scenario``
+    holding the settings of the web map of the given ``region.Region``
+    when first loaded, namely the region's median annual income,
+    a commute by bicycle on 5 workdays with no parking cost to the area
+    unit containing the work marker, renting 1 of 2 bedrooms, and owning
+    no cars, under the name '2_bedrooms', and the same settings with
+    b = 1, ..., ``MAX_BEDROOMS`` bedrooms under the names 'b_bedrooms'.
+
+    The work markers start outside the area units of their regions, 
+    in which case the commute contributes nothing, as in the web map,
+    and the number of bedrooms is the only setting that changes 
+    the colors before the user places a marker.
+    """
+    lat, lon = WORK_LAT_LON_BY_REGION[region.name]
+    polygon_by_name = get_polygon_by_property(region.get_shapes(),
+      NAME_FIELD)
+    work_area_unit = assign_points_to_polygons([(lon, lat)],
+      polygon_by_name)[0]
+    income = MEDIAN_ANNUAL_INCOME_BY_REGION[region.name]
+    commutes = [Commute(work_area_unit, 'bicycle', 5, 0)]
+    return {'{!s}_bedrooms'.format(b): Scenario(income, commutes, b, 1, 0)
+      for b in range(1, MAX_BEDROOMS + 1)}
+
+def get_tile_coordinates(lon, lat, zoom):
+    """
+    Return the pair (x, y) of fractional slippy map tile coordinates
+    at the given zoom level of the given WGS84 longitude and latitude.
+    The tile containing the point is the pair of their floors.
+    """
+    n = 2**zoom
+    lat = math.radians(lat)
+    x = (lon + 180)/360*n
+    y = (1 - math.log(math.tan(lat) + 1/math.cos(lat))/math.pi)/2*n
+    return x, y
+
+def get_tile_bounds(zoom, x, y):
+    """
+    Return the WGS84 bounds (west, south, east, north) of the slippy map
+    tile with the given zoom level and coordinates.
+    """
+    n = 2**zoom
+    def get_lat(y):
+        return math.degrees(math.atan(math.sinh(math.pi*(1 - 2*y/n))))
+
+    return x/n*360 - 180, get_lat(y + 1), (x + 1)/n*360 - 180, get_lat(y)
+
+def get_zoom_tolerance(zoom):
+    """
+    Return the width in degrees of longitude of a pixel at the given
+    zoom level, which is the tolerance to which shapes are simplified
+    for that zoom level.
+    """
+    return 360/(TILE_SIZE*2**zoom)
+
+# Shapes and feature properties of the worker processes of
+# ``create_tiles()``
+worker_state = None
+
+def init_worker(collection, arcs, geometries, properties_by_scenario,
+  path):
+    global worker_state
+    worker_state = (collection, arcs, geometries, properties_by_scenario,
+      path)
+
+def render_zoom(zoom):
+    """
+    Write the tiles at the given zoom level of each scenario of this
+    worker process to ``<path>/<scenario>/<zoom>/<x>/<y>.geojson``,
+    skipping tiles that intersect no area unit, and return the number
+    of tiles written per scenario.
+    """
+    collection, arcs, geometries, properties_by_scenario, path =\
+      worker_state
+    tolerance = get_zoom_tolerance(zoom)
+    # Round coordinates to about a tenth of a pixel
+    digits = max(0, int(math.ceil(-math.log10(tolerance/10))))
+    simplified = topology_to_geojson(collection,
+      simplify_arcs(arcs, geometries, tolerance), geometries)
+    polygons = np.array([shapely.make_valid(shape(f['geometry']))
+      for f in simplified['features']], dtype=object)
+    tree = shapely.STRtree(polygons)
+
+    west, south, east, north = shapely.total_bounds(polygons).tolist()
+    x0, y0 = get_tile_coordinates(west, north, zoom)
+    x1, y1 = get_tile_coordinates(east, south, zoom)
+    count = 0
+    for x in range(int(x0), int(x1) + 1):
+        for y in range(int(y0), int(y1) + 1):
+            w, s, e, n = get_tile_bounds(zoom, x, y)
+            margin_x = (e - w)*TILE_BUFFER/TILE_SIZE
+            margin_y = (n - s)*TILE_BUFFER/TILE_SIZE
+            bounds = (w - margin_x, s - margin_y, e + margin_x,
+              n + margin_y)
+            indices = tree.query(shapely.box(*bounds),
+              predicate='intersects')
+            if not len(indices):
+                continue
+            indices.sort()
+            clipped = shapely.clip_by_rect(polygons[indices], *bounds)
+            clipped = [(i, mapping(shapely.transform(g,
+              lambda c: np.round(c, digits))))
+              for i, g in zip(indices.tolist(), clipped) if not g.is_empty]
+            if not clipped:
+                continue
+            for scenario, properties in properties_by_scenario.items():
+                directory = os.path.join(path, scenario, str(zoom), str(x))
+                os.makedirs(directory, exist_ok=True)
+                features = [{'type': 'Feature', 'geometry': g,
+                  'properties': properties[i]} for i, g in clipped]
+                dump_json({'type': 'FeatureCollection',
+                  'features': features},
+                  os.path.join(directory, str(y) + '.geojson'),
+                  compact=True)
+            count += 1
+    return count
+
+def create_tiles(region, key=None, zooms=TILE_ZOOMS, num_workers=None,
+  scenario_by_name=None, digits=5):
+    """
+    Render the tiles of the given scenarios (a dictionary with structure
+    scenario name -> ``Scenario``), which default to the default
+    scenarios of the given ``region.Region`` (see
+    ``get_default_scenarios()``), at the given
+    zoom levels from the region's shapes and rents and the commute costs
+    file with the given key in ``region.path_by_data`` (defaulting to
+    the one the web map uses), in parallel across zoom levels with at
+    most ``num_workers`` processes (defaulting to the number of CPUs).
+    Quantize the shapes to ``digits`` decimal places before simplifying
+    them; see ``topology.build_topology()``.
+
+    Write the tiles to the directory ``region.path_by_data['tiles']``,
+    in the subdirectory named after each scenario; see
+    ``render_zoom()``.
+    Each feature of a tile has the properties ``NAME_FIELD``, 'fraction'
+    (the weekly total cost fraction rounded to 4 decimal places, or
+    ``None`` if undefined), and 'color' (see ``get_colors()``).
+    Also write an index JSON file ``index.json`` to the directory,
+    listing the zoom levels, the settings of each scenario,
+    the bins, labels, and colors, and the number of tiles per zoom level
+    of each scenario.
+    Return the decoded index.
+    """
+    if key is None:
+        key = region.get_web_commute_costs_key()
+    model = AffordabilityModel.from_region(region, key)
+    if scenario_by_name is None:
+        scenario_by_name = get_default_scenarios(region)
+    collection = region.get_shapes()
+    names = [f['properties'][NAME_FIELD] for f in collection['features']]
+    properties_by_scenario = {}
+    for name, scenario in scenario_by_name.items():
+        fractions = model.get_weekly_total_cost_fractions(*scenario)
+        value_by_name = model.to_dict(fractions)
+        indices = [model.index_by_name[n] for n in names]
+        colors = get_colors(fractions[indices])
+        properties_by_scenario[name] = [{NAME_FIELD: n,
+          'fraction': value_by_name[n], 'color': c}
+          for n, c in zip(names, colors)]
+
+    # Keep only the geometries in the workers
+    collection = {'type': 'FeatureCollection', 'features': [
+      {'geometry': f['geometry'], 'properties': {}}
+      for f in collection['features']]}
+    arcs, geometries = build_topology(collection, digits)
+    path = region.path_by_data['tiles']
+    with ProcessPoolExecutor(max_workers=num_workers,
+      initializer=init_worker, initargs=(collection, arcs, geometries,
+      properties_by_scenario, path)) as executor:
+        counts = list(executor.map(render_zoom, zooms))
+
+    index = {
+      'zooms': list(zooms),
+      'commute_costs': key,
+      'scenarios': {name: {
+        'income': s.income,
+        'commutes': [c._asdict() for c in s.commutes],
+        'num_bedrooms': s.num_bedrooms,
+        'num_bedrooms_rent': s.num_bedrooms_rent,
+        'num_cars': s.num_cars,
+        } for name, s in scenario_by_name.items()},
+      'bins': BINS,
+      'labels': LABELS,
+      'colors': COLORS,
+      'num_tiles_by_zoom': {str(z): c for z, c in zip(zooms, counts)},
+    }
+    dump_json(index, os.path.join(path, 'index.json'))
+    return index
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Render the web map tiles '
+      'of the default scenarios of regions of New Zealand.')
+    parser.add_argument('regions', nargs='*', metavar='region',
+      help='regions, from {!s}; defaults to all'.format(sorted(REGIONS)))
+    parser.add_argument('-k', '--key', default=None,
+      choices=['commute_costs', 'fake_commute_costs'],
+      help='commute costs file to use; defaults to the one the web map '
+      'uses')
+    parser.add_argument('-z', '--zooms', type=int, nargs='+',
+      default=TILE_ZOOMS, help='zoom levels')
+    parser.add_argument('-w', '--workers', type=int, default=None,
+      help='number of worker processes; defaults to the number of CPUs')
+    args = parser.parse_args()
+
+    for name in args.regions or sorted(REGIONS):
+        print('Rendering tiles for {!s}...'.format(name))
+        index = create_tiles(Region(os.path.join('data', name) + '/'),
+          args.key, args.zooms, args.workers)
+        print('  Tiles per zoom level:', index['num_tiles_by_zoom'])
@@ -0,0 +1,309 @@
+"""
+``topology.py``
+
+This module contains the functions that slim down decoded GeoJSON
+feature collections of (multi)polygons, such as the area unit shapes
+of a region, for use on the web.
+
+It cuts the rings of the polygons into arcs at the points where
+neighboring polygons meet, so that each boundary shared by two polygons
+is stored, and simplified, only once.
+Simplifying shared boundaries once keeps neighboring polygons
+fitting together without gaps, unlike simplifying each polygon on its
+own, and arcs that the simplification makes cross are simplified less,
+so that it makes no polygons invalid or overlapping;
+see ``simplify_arcs()``.
+The arcs can then be assembled back into GeoJSON or written as
+`TopoJSON <https://github.com/topojson/topojson-specification>`_.
+"""
+import numpy as np
+import shapely
+from shapely.geometry import LineString, MultiPoint, Polygon
+
+def get_polygons(geometry):
+    """
+    Return the list of polygons, each a list of rings, of the given
+    decoded GeoJSON Polygon or MultiPolygon geometry.
+    """
+    if geometry['type'] == 'Polygon':
+        return [geometry['coordinates']]
+    elif geometry['type'] == 'MultiPolygon':
+        return geometry['coordinates']
+    else:
+        raise ValueError('Geometry type must be Polygon or MultiPolygon, '
+          'not {!s}'.format(geometry['type']))
+
+def quantize_ring(ring, digits=5):
+    """
+    Round the coordinates of the given ring (list of points) to
+    ``digits`` decimal places, drop consecutive duplicate points
+    created by the rounding, and return the resulting closed ring as a
+    list of tuples.
+    """
+    result = []
+    for point in ring:
+        point = (round(point[0], digits), round(point[1], digits))
+        if not result or point != result[-1]:
+            result.append(point)
+    if result[0] != result[-1]:
+        result.append(result[0])
+    return result
+
+def get_junctions(rings):
+    """
+    Given a list of closed rings (lists of point tuples), return the set
+    of junctions, that is, points at which the rings meet or part ways.
+    A point is a junction if it appears in the rings with more than one
+    (unordered) pair of neighboring points.
+    """
+    pair_by_point = {}
+    junctions = set()
+    for ring in rings:
+        n = len(ring) - 1
+        for k in range(n):
+            previous_point = ring[k - 1] if k else ring[n - 1]
+            next_point = ring[k + 1]
+            pair = tuple(sorted([previous_point, next_point]))
+            if pair_by_point.setdefault(ring[k], pair) != pair:
+                junctions.add(ring[k])
+    return junctions
+
+def cut_ring(ring, junctions):
+    """
+    Cut the given closed ring into arcs at the given junctions and
+    return the list of arcs (lists of point tuples), which join up
+    end to start to give the ring.
+    If the ring contains no junctions, then return it as one arc
+    starting at its least point, so that equal rings give equal arcs.
+    """
+    points = ring[:-1]
+    cuts = [k for (k, point) in enumerate(points) if point in junctions]
+    if not cuts:
+        k = points.index(min(points))
+        return [points[k:] + points[:k] + [points[k]]]
+    points = points[cuts[0]:] + points[:cuts[0]] + [points[cuts[0]]]
+    cuts = [k - cuts[0] for k in cuts] + [len(points) - 1]
+    return [points[a:b + 1] for (a, b) in zip(cuts[:-1], cuts[1:])]
+
+def build_topology(collection, digits=5):
+    """
+    Given a decoded GeoJSON feature collection of (multi)polygons,
+    quantize its coordinates to ``digits`` decimal places and cut its
+    rings into arcs (see ``get_junctions()`` and ``cut_ring()``),
+    storing each arc only once.
+
+    Return the pair (arcs, geometries), where ``arcs`` is the list of
+    distinct arcs (lists of point tuples) and ``geometries`` is the list
+    of the geometries of the features, each encoded as a list of
+    polygons, each a list of rings, each a list of arc indices.
+    As in TopoJSON, index ``~i`` refers to arc ``i`` reversed.
+    """
+    polygons_by_feature = [[[quantize_ring(ring, digits) for ring in polygon]
+      for polygon in get_polygons(f['geometry'])]
+      for f in collection['features']]
+    junctions = get_junctions([ring for polygons in polygons_by_feature
+      for polygon in polygons for ring in polygon])
+
+    arcs = []
+    index_by_arc = {}
+    geometries = []
+    for polygons in polygons_by_feature:
+        geometry = []
+        for polygon in polygons:
+            new_polygon = []
+            for ring in polygon:
+                new_ring = []
+                for arc in cut_ring(ring, junctions):
+                    arc = tuple(arc)
+                    if arc in index_by_arc:
+                        i = index_by_arc[arc]
+                    elif arc[::-1] in index_by_arc:
+                        i = ~index_by_arc[arc[::-1]]
+                    else:
+                        i = len(arcs)
+                        index_by_arc[arc] = i
+                        arcs.append(list(arc))
+                    new_ring.append(i)
+                new_polygon.append(new_ring)
+            geometry.append(new_polygon)
+        geometries.append(geometry)
+    return arcs, geometries
+
+def get_crossings(arcs):
+    """
+    Return the set of pairs (i, j) with ``i <= j`` of indices of the 
+    given arcs (lists of point tuples) that intersect anywhere other
+    than at the endpoints that they share, where a pair (i, i) means
+    that arc i intersects itself.
+    """
+    lines = np.array([LineString(arc) for arc in arcs], dtype=object)
+    result = {(i, i) 
+      for i in np.nonzero(~shapely.is_simple(lines))[0].tolist()}
+    tree = shapely.STRtree(lines)
+    a, b = tree.query(lines, predicate='intersects')
+    keep = a < b
+    a, b = a[keep], b[keep]
+    intersections = shapely.intersection(lines[a], lines[b])
+    for i, j, g in zip(a.tolist(), b.tolist(), intersections):
+        shared = {arcs[i][0], arcs[i][-1]} & {arcs[j][0], arcs[j][-1]}
+        if not g.difference(MultiPoint(list(shared))).is_empty:
+            result.add((i, j))
+    return result
+
+def get_polygon_validity(arcs, geometries):
+    """
+    Return the list of ``(arc indices, valid)`` pairs, one per polygon 
+    of the given geometries (as output by ``build_topology()``),
+    where ``arc indices`` is the set of indices of the arcs 
+    of the polygon and ``valid`` is ``True`` if the polygon assembled 
+    from the given arcs is valid.
+    """
+    polygons = [polygon for geometry in geometries for polygon in geometry]
+    shapes = [Polygon(get_ring(arcs, polygon[0]), 
+      [get_ring(arcs, ring) for ring in polygon[1:]]) 
+      for polygon in polygons]
+    valid = shapely.is_valid(np.array(shapes, dtype=object)).tolist()
+    return [({i if i >= 0 else ~i for ring in polygon for i in ring}, v)
+      for polygon, v in zip(polygons, valid)]
+
+def simplify_arcs(arcs, geometries, tolerance, max_tries=4):
+    """
+    Simplify each of the given arcs (as output by ``build_topology()``)
+    with the Douglas-Peucker algorithm at the given tolerance
+    (in coordinate units), keeping its endpoints, and return the
+    resulting list of arcs.
+    Keep an arc as is if simplifying it would collapse a ring that it
+    belongs to, that is, if the ring would end up with fewer than 4
+    points.
+
+    Arcs are simplified independently, so a simplified arc can cross 
+    itself or another arc, making polygons invalid or overlap their
+    neighbors.
+    So keep the arcs that already cross as they are (see 
+    ``get_crossings()``), and after simplifying, find the arcs that 
+    cross where the original arcs do not and the arcs of polygons that
+    are invalid where the original polygons are valid, 
+    and simplify them again at half their tolerance, repeating until
+    none are left, and keeping the arcs that are still left after
+    ``max_tries`` halvings unsimplified.
+    """
+    # Minimum number of points of each arc
+    min_size = [2]*len(arcs)
+    for geometry in geometries:
+        for polygon in geometry:
+            for ring in polygon:
+                size = {1: 4, 2: 3}.get(len(ring), 2)
+                for i in ring:
+                    i = i if i >= 0 else ~i
+                    min_size[i] = max(min_size[i], size)
+
+    def simplify(i, tolerance):
+        if not tolerance:
+            return arcs[i]
+        new_arc = [tuple(p) for p in LineString(arcs[i]).simplify(
+          tolerance, preserve_topology=False).coords]
+        return new_arc if len(new_arc) >= min_size[i] else arcs[i]
+
+    if not tolerance:
+        return list(arcs)
+
+    # Keep the arcs that already cross as they are, and only require 
+    # polygons to be valid if they were originally
+    original_crossings = get_crossings(arcs)
+    crossing = {i for pair in original_crossings for i in pair}
+    originally_valid = [v for (indices, v) in 
+      get_polygon_validity(arcs, geometries)]
+    tolerances = [0 if i in crossing else tolerance 
+      for i in range(len(arcs))]
+    new_arcs = [simplify(i, t) for i, t in enumerate(tolerances)]
+    tries = 0
+    while True:
+        bad = set()
+        for i, j in get_crossings(new_arcs) - original_crossings:
+            bad.update([i, j])
+        for (indices, valid), was_valid in zip(
+          get_polygon_validity(new_arcs, geometries), originally_valid):
+            if was_valid and not valid:
+                bad.update(indices)
+        bad = [i for i in bad if tolerances[i]]
+        if not bad:
+            return new_arcs
+        tries += 1
+        for i in bad:
+            tolerances[i] = tolerances[i]/2 if tries < max_tries else 0
+            new_arcs[i] = simplify(i, tolerances[i])
+
+def get_ring(arcs, ring):
+    """
+    Join up the arcs with the given indices into a closed ring
+    and return it as a list of ``[x, y]`` lists.
+    """
+    points = []
+    for i in ring:
+        arc = arcs[i] if i >= 0 else arcs[~i][::-1]
+        points.extend(arc if not points else arc[1:])
+    return [list(p) for p in points]
+
+def topology_to_geojson(collection, arcs, geometries):
+    """
+    Given a decoded GeoJSON feature collection and the arcs and
+    geometries of its topology (see ``build_topology()``),
+    return a new decoded GeoJSON feature collection with the same
+    features but with geometries assembled from the arcs.
+    """
+    features = []
+    for f, geometry in zip(collection['features'], geometries):
+        coordinates = [[get_ring(arcs, ring) for ring in polygon]
+          for polygon in geometry]
+        if f['geometry']['type'] == 'Polygon':
+            coordinates = coordinates[0]
+        features.append({
+          'type': 'Feature',
+          'geometry': {
+            'type': f['geometry']['type'],
+            'coordinates': coordinates,
+            },
+          'properties': f['properties'],
+        })
+    return {'type': 'FeatureCollection', 'features': features}
+
+def topology_to_topojson(collection, arcs, geometries, digits=5,
+  object_name='features'):
+    """
+    Given a decoded GeoJSON feature collection and the arcs and
+    geometries of its topology (see ``build_topology()``),
+    return the corresponding decoded TopoJSON topology, whose one object
+    has the given name.
+    Quantize the arcs with a scale of ``10**(-digits)`` and delta-encode
+    them, as the TopoJSON specification allows.
+    """
+    scale = 10**(-digits)
+    x0 = min(p[0] for arc in arcs for p in arc)
+    y0 = min(p[1] for arc in arcs for p in arc)
+    encoded_arcs = []
+    for arc in arcs:
+        encoded_arc = []
+        previous = (0, 0)
+        for x, y in arc:
+            q = (int(round((x - x0)/scale)), int(round((y - y0)/scale)))
+            encoded_arc.append([q[0] - previous[0], q[1] - previous[1]])
+            previous = q
+        encoded_arcs.append(encoded_arc)
+
+    objects = []
+    for f, geometry in zip(collection['features'], geometries):
+        if f['geometry']['type'] == 'Polygon':
+            geometry = geometry[0]
+        objects.append({
+          'type': f['geometry']['type'],
+          'arcs': geometry,
+          'properties': f['properties'],
+        })
+    return {
+      'type': 'Topology',
+      'transform': {'scale': [scale, scale], 'translate': [x0, y0]},
+      'objects': {
+        object_name: {'type': 'GeometryCollection', 'geometries': objects},
+        },
+      'arcs': encoded_arcs,
+    }